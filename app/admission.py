@@ -0,0 +1,51 @@
+"""Admission control."""
+import asyncio
+import os
+import time
+from typing import Optional
+
+# Queries run at once, 0 for no limit
+MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", 32))
+# Queries that can wait for one to finish, more are rejected with a 503
+QUERY_QUEUE_SIZE = int(os.getenv("QUERY_QUEUE_SIZE", 64))
+# Seconds rejected clients are told to wait before trying again
+QUERY_RETRY_AFTER = int(os.getenv("QUERY_RETRY_AFTER", 10))
+
+
+class AdmissionQueue:
+    """Runs a limited number of queries at once, with a bounded queue of waiting ones."""
+
+    def __init__(self, limit: int = MAX_CONCURRENT_QUERIES, queue_size: int = QUERY_QUEUE_SIZE):
+        """Initialize."""
+        self.limit = limit
+        self.queue_size = queue_size
+        self.waiting = 0
+        # Created on first use, in the event loop serving queries
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def acquire(self) -> float:
+        """Wait for a slot and return how many seconds that took.
+
+        Raises asyncio.QueueFull if every slot is taken and the queue is full.
+        """
+        if self.limit <= 0:
+            return 0.0
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.limit)
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return 0.0
+        if self.waiting >= self.queue_size:
+            raise asyncio.QueueFull
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        return time.monotonic() - start
+
+    async def release(self):
+        """Give back a slot."""
+        if self._slots is not None:
+            self._slots.release()
@@ -0,0 +1,68 @@
+"""In-process caches."""
+from collections import OrderedDict
+import time
+from typing import Any, Hashable, Optional
+
+from .metrics import CACHES
+
+MISSING = object()
+
+
+class LRUCache:
+    """Least-recently-used cache with an optional time-to-live.
+
+    Entries past their TTL are dropped when they are next looked up.
+    Caches given a name are reported in the metrics.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, name: Optional[str] = None):
+        """Initialize."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._store = OrderedDict()
+        if name is not None:
+            CACHES[name] = self
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Get a value, or default if it is missing or expired."""
+        try:
+            expires, value = self._store[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires is not None and expires < time.monotonic():
+            del self._store[key]
+            self.misses += 1
+            return default
+        self._store.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entries if full."""
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        self._store[key] = (expires, value)
+        self._store.move_to_end(key)
+        while len(self._store) > self.maxsize:
+            self._store.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries."""
+        self._store.clear()
+
+    def __len__(self):
+        return len(self._store)
+
+    def stats(self) -> dict:
+        """Get hit and miss counters."""
+        return {
+            "size": len(self._store),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,303 @@
+"""Compressed transport for upstream requests and client responses."""
+import asyncio
+import gzip
+import json
+import logging
+import os
+from typing import Any, Optional
+
+import httpx
+from starlette.datastructures import Headers, MutableHeaders
+
+from .diagnostics import DIAGNOSTIC_BODY_BYTES
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+LOGGER = logging.getLogger(__name__)
+
+# gzip, zstd or none
+UPSTREAM_COMPRESSION = os.getenv("UPSTREAM_COMPRESSION", "gzip").lower()
+# Request bodies smaller than this are sent as they are
+UPSTREAM_COMPRESSION_MIN_SIZE = int(os.getenv("UPSTREAM_COMPRESSION_MIN_SIZE", 64 * 1024))
+UPSTREAM_COMPRESSION_LEVEL = int(os.getenv("UPSTREAM_COMPRESSION_LEVEL", 3))
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "true").lower() == "true"
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv("RESPONSE_COMPRESSION_MIN_SIZE", 64 * 1024))
+RESPONSE_COMPRESSION_LEVEL = int(os.getenv("RESPONSE_COMPRESSION_LEVEL", 5))
+
+# Bodies this large are compressed off the event loop
+THREAD_THRESHOLD = 1024 * 1024
+# Statuses that may mean a service does not understand a compressed body.
+# Not 500, a transient failure must not turn compression off for good
+REJECTED_STATUSES = {400, 415, 422}
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Whether each service url accepts compressed bodies, once known
+ACCEPTS_COMPRESSION: dict[str, bool] = {}
+
+
+class ResponseTooLarge(Exception):
+    """An upstream response body is larger than allowed."""
+
+    def __init__(self, max_bytes: int, size: int):
+        """Initialize."""
+        super().__init__(f"Response body is larger than {max_bytes} bytes, stopped reading it after {size}")
+        self.max_bytes = max_bytes
+        self.size = size
+
+
+def zstd_available() -> bool:
+    """Check whether the optional zstd dependency is installed."""
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def request_encoding() -> Optional[str]:
+    """Get the encoding of compressed request bodies, if any."""
+    if UPSTREAM_COMPRESSION == "zstd" and not zstd_available():
+        LOGGER.warning("UPSTREAM_COMPRESSION is zstd but 'zstandard' is not installed, falling back to gzip")
+        return "gzip"
+    if UPSTREAM_COMPRESSION in ("gzip", "zstd"):
+        return UPSTREAM_COMPRESSION
+    return None
+
+
+REQUEST_ENCODING = request_encoding()
+ACCEPT_ENCODING = "zstd, gzip, deflate" if zstd_available() else "gzip, deflate"
+
+
+def compress(body: bytes, encoding: str, level: int = UPSTREAM_COMPRESSION_LEVEL) -> bytes:
+    """Compress a body with gzip or zstd."""
+    if encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    return gzip.compress(body, compresslevel=level)
+
+
+async def _compress(body: bytes, encoding: str, level: int) -> bytes:
+    if len(body) >= THREAD_THRESHOLD:
+        return await asyncio.to_thread(compress, body, encoding, level)
+    return compress(body, encoding, level)
+
+
+async def _post(client: httpx.AsyncClient, url: str, body: bytes, headers: dict, timeout, stream: bool):
+    request = client.build_request("POST", url, content=body, headers=headers, timeout=timeout)
+    return await client.send(request, stream=stream)
+
+
+async def post_json(
+    client: httpx.AsyncClient,
+    url: str,
+    payload: Any,
+    timeout=httpx.USE_CLIENT_DEFAULT,
+    stream: bool = False,
+) -> httpx.Response:
+    """POST a json payload, compressed if it is large and the service accepts it.
+
+    The payload may also be given already serialized, as bytes. With stream,
+    the response body is not read, and the response must be closed.
+
+    Until a service is known to accept compressed bodies, an error response
+    to one is retried with the plain body. If that works, the service is only
+    sent plain bodies from then on.
+    """
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    headers = {
+        "content-type": "application/json",
+        "accept-encoding": ACCEPT_ENCODING,
+    }
+    accepts = ACCEPTS_COMPRESSION.get(url)
+    if REQUEST_ENCODING is None or len(body) < UPSTREAM_COMPRESSION_MIN_SIZE or accepts is False:
+        return await _post(client, url, body, headers, timeout, stream)
+
+    response = await _post(
+        client,
+        url,
+        await _compress(body, REQUEST_ENCODING, UPSTREAM_COMPRESSION_LEVEL),
+        {**headers, "content-encoding": REQUEST_ENCODING},
+        timeout,
+        stream,
+    )
+    if response.status_code not in REJECTED_STATUSES:
+        if response.is_success:
+            ACCEPTS_COMPRESSION[url] = True
+        return response
+    if accepts:
+        return response
+    LOGGER.info("%s rejected a %s request body, sending it uncompressed", url, REQUEST_ENCODING)
+    await response.aclose()
+    retry = await _post(client, url, body, headers, timeout, stream)
+    if retry.status_code not in REJECTED_STATUSES:
+        # The plain body worked, so the compression was the problem
+        ACCEPTS_COMPRESSION[url] = False
+    return retry
+
+
+async def fetch_json(
+    client: httpx.AsyncClient,
+    url: str,
+    payload: Any,
+    timeout=httpx.USE_CLIENT_DEFAULT,
+    max_bytes: Optional[int] = None,
+) -> tuple[Any, int]:
+    """POST a json payload as post_json does, and decode the response as it arrives.
+
+    Returns the decoded response and its size in bytes. Error responses
+    raise httpx.HTTPStatusError, holding the start of their body only, and
+    bodies larger than max_bytes raise ResponseTooLarge.
+    """
+    response = await post_json(client, url, payload, timeout=timeout, stream=True)
+    try:
+        if response.is_error:
+            await _raise_for_status(response)
+        return await read_json(response, max_bytes)
+    finally:
+        await response.aclose()
+
+
+async def _raise_for_status(response: httpx.Response):
+    # Only as much of the body is read as is logged
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        body += chunk
+        if len(body) > DIAGNOSTIC_BODY_BYTES:
+            break
+    # A streamed response cannot be given its body once read, so the error
+    # is raised for a copy holding it, decoded
+    headers = [
+        (name, value) for name, value in response.headers.items()
+        if name not in ("content-encoding", "content-length")
+    ]
+    httpx.Response(
+        response.status_code,
+        headers=headers,
+        content=bytes(body),
+        request=response.request,
+    ).raise_for_status()
+
+
+async def read_json(response: httpx.Response, max_bytes: Optional[int] = None) -> tuple[Any, int]:
+    """Decode a streamed JSON response, including zstd bodies httpx cannot decode itself.
+
+    Returns the decoded response and its size in bytes. Reading stops with
+    ResponseTooLarge as soon as the body is larger than max_bytes. With the
+    optional ijson package the body is parsed as it arrives and never held
+    in memory as a whole.
+    """
+    length = response.headers.get("content-length", "")
+    if max_bytes and length.isdigit() and int(length) > max_bytes:
+        raise ResponseTooLarge(max_bytes, 0)
+    parser = _IncrementalParser() if ijson is not None else _BufferedParser()
+    decompressor = None
+    size = 0
+    async for chunk in response.aiter_bytes():
+        # Newer httpx versions decode zstd themselves
+        if not size and chunk[:4] == ZSTD_MAGIC and "zstd" in response.headers.get("content-encoding", ""):
+            import zstandard
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        size += len(chunk)
+        if max_bytes and size > max_bytes:
+            raise ResponseTooLarge(max_bytes, size)
+        parser.feed(chunk)
+    return parser.close(), size
+
+
+class _BufferedParser:
+    """Collects a body and decodes it once complete."""
+
+    def __init__(self):
+        """Initialize."""
+        self.body = bytearray()
+
+    def feed(self, chunk: bytes):
+        self.body += chunk
+
+    def close(self) -> Any:
+        return json.loads(self.body)
+
+
+class _IncrementalParser:
+    """Builds the decoded body as it arrives, with ijson."""
+
+    def __init__(self):
+        """Initialize."""
+        self.values = ijson.sendable_list()
+        self.parser = ijson.items_coro(self.values, "", use_float=True)
+
+    def feed(self, chunk: bytes):
+        try:
+            self.parser.send(chunk)
+        except ijson.JSONError as e:
+            raise json.JSONDecodeError(str(e), "", 0) from e
+
+    def close(self) -> Any:
+        try:
+            self.parser.close()
+        except ijson.JSONError as e:
+            raise json.JSONDecodeError(str(e), "", 0) from e
+        if not self.values:
+            raise json.JSONDecodeError("Expecting value", "", 0)
+        return self.values[0]
+
+
+class CompressionMiddleware:
+    """ASGI middleware that gzips large responses.
+
+    Unlike starlette's GZipMiddleware, only complete bodies are compressed,
+    so streamed progress events are sent as soon as they are written, and
+    large bodies are compressed off the event loop.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = RESPONSE_COMPRESSION_MIN_SIZE,
+        compresslevel: int = RESPONSE_COMPRESSION_LEVEL,
+    ):
+        """Initialize."""
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("accept-encoding", ""):
+            await self.app(scope, receive, send)
+            return
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start_message["headers"])
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+            body = await _compress(body, "gzip", self.compresslevel)
+            headers["Content-Encoding"] = "gzip"
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_wrapper)
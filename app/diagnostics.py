@@ -0,0 +1,117 @@
+"""Diagnostics of failed upstream requests."""
+import asyncio
+import os
+import time
+from typing import Any, Optional, Union
+import uuid
+
+import httpx
+
+from .serialization import dumps
+
+# Bytes of a request or response body kept in the logs
+DIAGNOSTIC_BODY_BYTES = int(os.getenv("DIAGNOSTIC_BODY_BYTES", 4096))
+# Directory the full bodies of failed upstream requests are saved to,
+# unset to not save them
+DEBUG_CAPTURE_DIR = os.getenv("DEBUG_CAPTURE_DIR")
+# Lists longer than this are elided from logged payloads
+MAX_LOGGED_ITEMS = 10
+
+
+def preview(body: Union[bytes, str], limit: int = DIAGNOSTIC_BODY_BYTES) -> str:
+    """Truncate a body for logging."""
+    text = body[:limit]
+    if isinstance(text, bytes):
+        text = text.decode("utf-8", errors="replace")
+    if len(body) > limit:
+        text += f"... ({len(body)} {'bytes' if isinstance(body, bytes) else 'characters'} in total)"
+    return text
+
+
+def _elide(items: Any, name: str) -> Any:
+    if isinstance(items, list) and len(items) > MAX_LOGGED_ITEMS:
+        return f"**{len(items)} {name} not shown for brevity**"
+    return items
+
+
+def _count(container: Any, name: str) -> Any:
+    if isinstance(container, (dict, list)):
+        return f"**{len(container)} {name} not shown for brevity**"
+    return container
+
+
+def _summarize_qnode(qnode: Any) -> Any:
+    if isinstance(qnode, dict):
+        ids = _elide(qnode.get("ids"), "CURIEs")
+        if ids is not qnode.get("ids"):
+            return {**qnode, "ids": ids}
+    return qnode
+
+
+def summarize_payload(payload: Any) -> Any:
+    """Summarize a request payload for logging, without copying it.
+
+    CURIEs of query nodes with many of them are elided, and the knowledge
+    graph, auxiliary graphs and results are reduced to their sizes.
+    Long lists in other payloads are elided.
+    """
+    if not isinstance(payload, dict):
+        return payload
+    message = payload.get("message")
+    if not isinstance(message, dict):
+        return {key: _elide(value, "items") for key, value in payload.items()}
+
+    summary = dict(payload)
+    summary["message"] = message_summary = {}
+    qgraph = message.get("query_graph")
+    if isinstance(qgraph, dict) and isinstance(qgraph.get("nodes"), dict):
+        message_summary["query_graph"] = {
+            **qgraph,
+            "nodes": {
+                qnode_id: _summarize_qnode(qnode)
+                for qnode_id, qnode in qgraph["nodes"].items()
+            },
+        }
+    else:
+        message_summary["query_graph"] = qgraph
+    kgraph = message.get("knowledge_graph")
+    if isinstance(kgraph, dict):
+        message_summary["knowledge_graph"] = {
+            "nodes": _count(kgraph.get("nodes"), "nodes"),
+            "edges": _count(kgraph.get("edges"), "edges"),
+        }
+    if message.get("auxiliary_graphs") is not None:
+        message_summary["auxiliary_graphs"] = _count(message["auxiliary_graphs"], "auxiliary graphs")
+    if message.get("results") is not None:
+        message_summary["results"] = _count(message["results"], "results")
+    return summary
+
+
+def _write_capture(path: str, service_name: str, payload: Any, response: Any):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".request.json", "wb") as stream:
+        stream.write(dumps({"service": service_name, "payload": payload}))
+    if response is not None:
+        with open(path + ".response", "wb") as stream:
+            stream.write(response.content if isinstance(response, httpx.Response) else dumps(response))
+
+
+async def capture(
+    service_name: str,
+    payload: Any,
+    response: Any = None,
+    directory: Optional[str] = DEBUG_CAPTURE_DIR,
+) -> Optional[str]:
+    """Save the full request payload and response body of a failed request.
+
+    The response may be given as a httpx.Response, or as its decoded body.
+
+    Returns the path the bodies are saved under, without the .request.json
+    and .response suffixes, or None if debug capture is off.
+    """
+    if not directory:
+        return None
+    path = os.path.join(directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4()}")
+    # Payloads can be large, serialize them off the event loop
+    await asyncio.to_thread(_write_capture, path, service_name, payload, response)
+    return path
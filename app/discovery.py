@@ -0,0 +1,98 @@
+"""Service discovery."""
+import asyncio
+from collections import defaultdict
+import logging
+import os
+from typing import Optional
+
+import httpx
+from pydantic import HttpUrl, ValidationError
+from pydantic.tools import parse_obj_as
+
+from .http_client import client_session
+
+SERVICE_PROBE_TIMEOUT = float(os.getenv("SERVICE_PROBE_TIMEOUT", 5.0))
+SERVICE_PROBE_CONCURRENCY = int(os.getenv("SERVICE_PROBE_CONCURRENCY", 16))
+
+
+def resolve_base_url(endpoint: dict, logger: logging.Logger) -> Optional[str]:
+    """Resolve the base url of a SmartAPI endpoint."""
+    try:
+        return parse_obj_as(HttpUrl, endpoint["url"])
+    except ValidationError:
+        # It may contain a relative path
+        # This is aloud by smart-api
+        # And is relative to the source_url for the open-api doc
+        # https://spec.openapis.org/oas/latest.html#server-object
+        #
+        # The url can also reference variables in {brackets}
+        # This is not yet supported here
+        try:
+            source_url_stem = endpoint["source_url"][:endpoint["source_url"].rfind("/")]
+            full_url = source_url_stem + endpoint["url"]
+            return parse_obj_as(HttpUrl, full_url)
+        except ValidationError as err:
+            logger.warning("Invalid URL '%s' '%s': %s", endpoint["source_url"], endpoint["url"], err)
+            return None
+
+
+async def probe_endpoint(
+    client: httpx.AsyncClient,
+    base_url: str,
+    logger: logging.Logger,
+    timeout: float = SERVICE_PROBE_TIMEOUT,
+) -> bool:
+    """Check if we can contact an endpoint."""
+    try:
+        response = await client.get(base_url + "/query", follow_redirects=True, timeout=timeout)
+    except httpx.TransportError:
+        logger.warning("Discarding '%s due to timeout.", base_url)
+        return False
+    if response.status_code == 404:
+        # Not a valid URL
+        try:
+            response = await client.post(base_url + "/query", timeout=timeout)
+        except httpx.TransportError:
+            logger.warning("Discarding '%s due to timeout after 404.", base_url)
+            return False
+        if response.status_code == 404:
+            logger.warning("404 recieved for '%s'", base_url)
+            return False
+    # More than likely this is a 405 or some other error
+    # Any response at this point is good
+    return True
+
+
+async def discover_services(
+    endpoints: list[dict],
+    logger: logging.Logger,
+    timeout: float = SERVICE_PROBE_TIMEOUT,
+    concurrency: int = SERVICE_PROBE_CONCURRENCY,
+) -> dict[str, list[dict]]:
+    """Probe endpoints concurrently and build a services table keyed by operation."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with client_session() as client:
+        async def probe(endpoint):
+            base_url = resolve_base_url(endpoint, logger)
+            if base_url is None:
+                return False
+            async with semaphore:
+                if not await probe_endpoint(client, base_url, logger, timeout):
+                    return False
+            endpoint["url"] = base_url + "/query"
+            return True
+
+        reachable = await asyncio.gather(*(
+            probe(endpoint) for endpoint in endpoints
+        ))
+
+    services = defaultdict(list)
+    for endpoint, ok in zip(endpoints, reachable):
+        if not ok:
+            continue
+        # Popped for cleanliness in /services enpoint
+        operations = endpoint.pop("operations")
+        for operation in operations:
+            services[operation].append(endpoint)
+    return dict(services)
@@ -0,0 +1,150 @@
+"""Service provider health."""
+from collections import deque
+import os
+import time
+from typing import Optional
+
+# Consecutive failures that open a service's circuit
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+# Seconds an open circuit waits before letting a trial request through
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+# Number of recent requests the error rate is computed over
+HEALTH_WINDOW = int(os.getenv("HEALTH_WINDOW", 20))
+# Weight of the latest request in the moving average latency
+HEALTH_LATENCY_ALPHA = float(os.getenv("HEALTH_LATENCY_ALPHA", 0.3))
+
+
+class ServiceHealth:
+    """Rolling latency and error rate of one service, and its circuit."""
+
+    def __init__(self, window: int = HEALTH_WINDOW):
+        """Initialize."""
+        self.outcomes = deque(maxlen=window)
+        self.latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.opened: Optional[float] = None
+        self.trial = False
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def record(self, success: bool, duration: float, alpha: float, threshold: int):
+        self.outcomes.append(success)
+        if self.latency is None:
+            self.latency = duration
+        else:
+            self.latency = alpha * duration + (1 - alpha) * self.latency
+        self.trial = False
+        if success:
+            self.consecutive_failures = 0
+            self.opened = None
+            return
+        self.consecutive_failures += 1
+        if self.opened is not None or self.consecutive_failures >= threshold:
+            # A failed trial opens the circuit again
+            self.opened = time.monotonic()
+
+    def state(self, reset_timeout: float) -> str:
+        if self.opened is None:
+            return "closed"
+        if time.monotonic() - self.opened >= reset_timeout:
+            return "half-open"
+        return "open"
+
+
+class HealthTracker:
+    """Per-service circuit breakers and latency-aware provider ordering.
+
+    Services are keyed by URL. A service's circuit opens after a run of
+    consecutive failures; once the reset timeout has passed, a single trial
+    request is let through, and its outcome closes or reopens the circuit.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+        window: int = HEALTH_WINDOW,
+        alpha: float = HEALTH_LATENCY_ALPHA,
+    ):
+        """Initialize."""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.window = window
+        self.alpha = alpha
+        self.services: dict[str, ServiceHealth] = {}
+
+    def _get(self, url: str) -> ServiceHealth:
+        health = self.services.get(url)
+        if health is None:
+            health = self.services[url] = ServiceHealth(self.window)
+        return health
+
+    def record(self, url: str, success: bool, duration: float):
+        """Record the outcome of a request to a service."""
+        self._get(url).record(success, duration, self.alpha, self.failure_threshold)
+
+    def release(self, url: str):
+        """Give back a claimed trial whose request ended without an outcome, e.g. was cancelled."""
+        health = self.services.get(url)
+        if health is not None:
+            health.trial = False
+
+    def available(self, url: str) -> bool:
+        """Check whether a service may be queried, without claiming a trial."""
+        health = self.services.get(url)
+        if health is None:
+            return True
+        state = health.state(self.reset_timeout)
+        return state == "closed" or (state == "half-open" and not health.trial)
+
+    def allow(self, url: str) -> bool:
+        """Check whether a service may be queried, claiming the trial of a half-open circuit."""
+        health = self.services.get(url)
+        if health is None:
+            return True
+        state = health.state(self.reset_timeout)
+        if state == "closed":
+            return True
+        if state == "half-open" and not health.trial:
+            health.trial = True
+            return True
+        return False
+
+    def select(self, services: list[dict]) -> tuple[list[dict], list[dict]]:
+        """Split services into those that may be queried and those skipped.
+
+        Trials are not claimed, call allow before actually querying a service.
+        """
+        allowed, skipped = [], []
+        for service in services:
+            (allowed if self.available(service["url"]) else skipped).append(service)
+        return allowed, skipped
+
+    def order(self, services: list[dict]) -> list[dict]:
+        """Order services by error rate, then latency, keeping registry order for ties.
+
+        Services without any history are tried before slower known ones.
+        """
+        def key(service):
+            health = self.services.get(service["url"])
+            if health is None:
+                return (0.0, 0.0)
+            return (health.error_rate, health.latency or 0.0)
+        return sorted(services, key=key)
+
+    def score(self, url: str) -> dict:
+        """Get the current health of a service."""
+        health = self.services.get(url)
+        if health is None:
+            return {"state": "closed", "requests": 0}
+        return {
+            "state": health.state(self.reset_timeout),
+            "requests": len(health.outcomes),
+            "error_rate": round(health.error_rate, 3),
+            "latency": round(health.latency, 3),
+            "consecutive_failures": health.consecutive_failures,
+        }
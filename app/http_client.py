@@ -0,0 +1,151 @@
+"""Shared HTTP client."""
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import logging
+import os
+from typing import Callable, Optional
+
+import httpx
+
+LOGGER = logging.getLogger(__name__)
+
+HTTP2 = os.getenv("HTTP2", "false").lower() == "true"
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 200))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 50))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30.0))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", 20))
+# Per-host overrides, e.g. '{"nodenormalization-sri.renci.org": 50}'
+HTTP_HOST_LIMITS = json.loads(os.getenv("HTTP_HOST_LIMITS", "{}"))
+
+# Process-wide client.
+# It is opened on app startup and closed on app shutdown.
+HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response stream that releases a host slot when it is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class HostLimitTransport(httpx.AsyncBaseTransport):
+    """Transport that caps concurrent requests to each upstream host.
+
+    httpx only limits the size of the whole pool, so a single slow KP could
+    otherwise take every connection.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        max_per_host: int,
+        host_limits: Optional[dict[str, int]] = None,
+    ):
+        self._transport = transport
+        self._max_per_host = max_per_host
+        self._host_limits = host_limits or {}
+        self._semaphores = {}
+
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        if host not in self._semaphores:
+            limit = self._host_limits.get(host, self._max_per_host)
+            self._semaphores[host] = asyncio.Semaphore(limit)
+        return self._semaphores[host]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        semaphore = self._semaphore(request.url.host)
+        await semaphore.acquire()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, semaphore.release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def http2_available() -> bool:
+    """Check whether the optional HTTP/2 dependency is installed."""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_client(timeout: Optional[float] = 60.0) -> httpx.AsyncClient:
+    """Build a pooled client for upstream services."""
+    http2 = HTTP2
+    if http2 and not http2_available():
+        LOGGER.warning("HTTP2 is enabled but 'h2' is not installed, falling back to HTTP/1.1")
+        http2 = False
+    transport = httpx.AsyncHTTPTransport(
+        verify=False,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+    return httpx.AsyncClient(
+        transport=HostLimitTransport(
+            transport,
+            HTTP_MAX_CONNECTIONS_PER_HOST,
+            HTTP_HOST_LIMITS,
+        ),
+        verify=False,
+        timeout=timeout,
+    )
+
+
+async def open_client():
+    """Open the process-wide client."""
+    global HTTP_CLIENT
+    if HTTP_CLIENT is None:
+        HTTP_CLIENT = build_client()
+
+
+async def close_client():
+    """Close the process-wide client."""
+    global HTTP_CLIENT
+    if HTTP_CLIENT is not None:
+        client, HTTP_CLIENT = HTTP_CLIENT, None
+        await client.aclose()
+
+
+@asynccontextmanager
+async def client_session():
+    """Yield the process-wide client.
+
+    Outside of the app lifespan (e.g. in tests that never start the app)
+    a short-lived client is used instead.
+    """
+    if HTTP_CLIENT is not None:
+        yield HTTP_CLIENT
+        return
+    async with build_client() as client:
+        yield client
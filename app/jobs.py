@@ -0,0 +1,156 @@
+"""Asynchronous query jobs."""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional
+import uuid
+
+import httpx
+
+from .http_client import client_session
+from .serialization import dumps
+from .util import log_response
+
+LOGGER = logging.getLogger(__name__)
+
+ASYNC_WORKERS = int(os.getenv("ASYNC_WORKERS", 4))
+ASYNC_QUEUE_SIZE = int(os.getenv("ASYNC_QUEUE_SIZE", 100))
+ASYNC_RETENTION = float(os.getenv("ASYNC_RETENTION", 60 * 60))
+ASYNC_CALLBACK_TIMEOUT = float(os.getenv("ASYNC_CALLBACK_TIMEOUT", 60.0))
+
+
+class Job:
+    """An asynchronous query."""
+
+    def __init__(self, request_dict: dict, logger: logging.Logger):
+        """Initialize."""
+        self.id = str(uuid.uuid4())
+        self.request_dict = request_dict
+        self.callback = request_dict.pop("callback")
+        self.logger = logger
+        self.status = "Queued"
+        self.description = "Query is queued."
+        self.response: Optional[dict] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def logs(self) -> list[dict]:
+        return self.logger.handlers[0].store
+
+    def finish(self, status: str, description: str):
+        self.status = status
+        self.description = description
+        self.finished = time.monotonic()
+        # The request is no longer needed, keep only the response
+        self.request_dict = None
+
+
+class JobQueue:
+    """Bounded queue of asynchronous queries, run by a pool of workers.
+
+    Completed jobs, and their responses, are kept for the retention period
+    so that their status can be polled.
+    """
+
+    def __init__(
+        self,
+        run: Callable[[dict, logging.Logger], Awaitable[dict]],
+        workers: int = ASYNC_WORKERS,
+        maxsize: int = ASYNC_QUEUE_SIZE,
+        retention: float = ASYNC_RETENTION,
+    ):
+        """Initialize."""
+        self.run = run
+        self.workers = workers
+        self.maxsize = maxsize
+        self.retention = retention
+        self.jobs: dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+
+    async def start(self):
+        """Start the workers."""
+        self._queue = asyncio.Queue(self.maxsize)
+        self._tasks = [
+            asyncio.create_task(self._work())
+            for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Stop the workers, abandoning queued jobs."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, request_dict: dict, logger: logging.Logger) -> Job:
+        """Queue a query.
+
+        Raises asyncio.QueueFull when the queue is full.
+        """
+        self._purge()
+        job = Job(request_dict, logger)
+        self._queue.put_nowait(job)
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Get a job that is queued, running or within its retention period."""
+        self._purge()
+        return self.jobs.get(job_id)
+
+    def _purge(self):
+        now = time.monotonic()
+        for job_id in [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished is not None and now - job.finished > self.retention
+        ]:
+            del self.jobs[job_id]
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run_job(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job: Job):
+        job.status = "Running"
+        job.description = "Query is running."
+        try:
+            job.response = await self.run(job.request_dict, job.logger)
+        except Exception as e:
+            LOGGER.exception("Async query %s failed", job.id)
+            job.logger.error({
+                "message": "Async query failed",
+                "error": str(e),
+            })
+            job.finish("Failed", "Query failed, see the logs.")
+            return
+        job.response["status"] = "Success"
+        job.finish("Completed", "Query completed.")
+        await self._send_callback(job)
+
+    async def _send_callback(self, job: Job):
+        try:
+            async with client_session() as client:
+                response = await client.post(
+                    job.callback,
+                    content=dumps(job.response),
+                    headers={"content-type": "application/json"},
+                    timeout=ASYNC_CALLBACK_TIMEOUT,
+                )
+                response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            job.logger.warning({
+                "message": f"Error response from callback {job.callback}",
+                "error": str(e),
+                "response": log_response(e.response),
+            })
+        except Exception as e:
+            job.logger.warning({
+                "message": f"Unable to send response to callback {job.callback}",
+                "error": str(e),
+            })
@@ -0,0 +1,241 @@
+"""Standard operations run in-process.
+
+These operations only reorder or prune the message, so running them here
+saves sending the whole message to a service provider and back. Messages
+are never modified, the operations build new containers around the
+original nodes, edges and results.
+"""
+import logging
+import os
+from typing import Callable, Optional
+
+from .serialization import dumps
+
+# Run supported operations locally unless an operation sets "local": false
+LOCAL_OPERATIONS = os.getenv("LOCAL_OPERATIONS", "false").lower() == "true"
+# Compact the message after every operation unless an operation sets "compact": false
+COMPACT_MESSAGES = os.getenv("COMPACT_MESSAGES", "false").lower() == "true"
+
+
+def result_score(result: dict) -> Optional[float]:
+    """Get the best score of a result's analyses."""
+    scores = [
+        analysis["score"]
+        for analysis in result.get("analyses") or []
+        if analysis.get("score") is not None
+    ]
+    return max(scores) if scores else None
+
+
+def sort_results_score(message: dict, parameters: dict) -> dict:
+    """Sort results by score, unscored results last."""
+    scored = []
+    unscored = []
+    for result in message.get("results") or []:
+        score = result_score(result)
+        if score is None:
+            unscored.append(result)
+        else:
+            scored.append((score, result))
+    scored.sort(
+        key=lambda pair: pair[0],
+        reverse=parameters["ascending_or_descending"] == "descending",
+    )
+    return {**message, "results": [result for _, result in scored] + unscored}
+
+
+def filter_results_top_n(message: dict, parameters: dict) -> dict:
+    """Keep the first max_results results."""
+    if message.get("results") is None:
+        return message
+    return {**message, "results": message["results"][:parameters["max_results"]]}
+
+
+def _support_graph_ids(edge: dict) -> list[str]:
+    for attribute in edge.get("attributes") or []:
+        if attribute.get("attribute_type_id") == "biolink:support_graphs":
+            value = attribute.get("value")
+            return value if isinstance(value, list) else [value]
+    return []
+
+
+def filter_kgraph_orphans(message: dict, parameters: dict) -> dict:
+    """Remove nodes, edges and auxiliary graphs the results do not use.
+
+    Edges in support graphs of kept edges and analyses are kept, along with
+    their own support graphs.
+    """
+    kgraph = message.get("knowledge_graph")
+    if not kgraph:
+        return message
+    nodes = kgraph.get("nodes") or {}
+    edges = kgraph.get("edges") or {}
+    auxgraphs = message.get("auxiliary_graphs") or {}
+
+    node_ids = set()
+    edge_ids = set()
+    auxgraph_ids = set()
+    pending_edges = []
+    pending_auxgraphs = []
+    for result in message.get("results") or []:
+        for bindings in result["node_bindings"].values():
+            node_ids.update(binding["id"] for binding in bindings)
+        for analysis in result.get("analyses") or []:
+            for bindings in (analysis.get("edge_bindings") or {}).values():
+                pending_edges.extend(binding["id"] for binding in bindings)
+            pending_auxgraphs.extend(analysis.get("support_graphs") or [])
+
+    while pending_edges or pending_auxgraphs:
+        while pending_auxgraphs:
+            auxgraph_id = pending_auxgraphs.pop()
+            if auxgraph_id in auxgraph_ids or auxgraph_id not in auxgraphs:
+                continue
+            auxgraph_ids.add(auxgraph_id)
+            pending_edges.extend(auxgraphs[auxgraph_id].get("edges") or [])
+        while pending_edges:
+            edge_id = pending_edges.pop()
+            if edge_id in edge_ids or edge_id not in edges:
+                continue
+            edge_ids.add(edge_id)
+            edge = edges[edge_id]
+            node_ids.add(edge["subject"])
+            node_ids.add(edge["object"])
+            pending_auxgraphs.extend(_support_graph_ids(edge))
+
+    filtered = {
+        **message,
+        "knowledge_graph": {
+            **kgraph,
+            "nodes": {node_id: node for node_id, node in nodes.items() if node_id in node_ids},
+            "edges": {edge_id: edge for edge_id, edge in edges.items() if edge_id in edge_ids},
+        },
+    }
+    if message.get("auxiliary_graphs") is not None:
+        filtered["auxiliary_graphs"] = {
+            auxgraph_id: auxgraph
+            for auxgraph_id, auxgraph in auxgraphs.items()
+            if auxgraph_id in auxgraph_ids
+        }
+    return filtered
+
+
+def filter_message_top_n(message: dict, parameters: dict) -> dict:
+    """Keep the first max_results results and what they use of the knowledge graph."""
+    return filter_kgraph_orphans(filter_results_top_n(message, parameters), {})
+
+
+def _removed(before: dict, after: dict) -> dict:
+    return {key: value for key, value in before.items() if key not in after}
+
+
+def compact_message(message: dict) -> tuple[dict, int]:
+    """Drop knowledge graph elements and auxiliary graphs no result uses.
+
+    Returns the compacted message and roughly how many bytes it saves when
+    serialized, measured on the removed elements only.
+    """
+    if message.get("results") is None or not message.get("knowledge_graph"):
+        return message, 0
+    compacted = filter_kgraph_orphans(message, {})
+    kgraph = message["knowledge_graph"]
+    compacted_kgraph = compacted["knowledge_graph"]
+    removed = [
+        _removed(kgraph.get("nodes") or {}, compacted_kgraph["nodes"]),
+        _removed(kgraph.get("edges") or {}, compacted_kgraph["edges"]),
+        _removed(message.get("auxiliary_graphs") or {}, compacted.get("auxiliary_graphs") or {}),
+    ]
+    # Removed entries take their separators with them, give or take a byte
+    saved = sum(len(dumps(elements)) - 1 for elements in removed if elements)
+    return compacted, saved
+
+
+# enrich_results needs enrichment statistics over the knowledge graph
+# providers' data, it always runs remotely.
+HANDLERS: dict[str, Callable[[dict, dict], dict]] = {
+    "sort_results_score": sort_results_score,
+    "filter_results_top_n": filter_results_top_n,
+    "filter_kgraph_orphans": filter_kgraph_orphans,
+    "filter_message_top_n": filter_message_top_n,
+}
+
+
+def parameter_schema(operation_id: str, operations: dict) -> Optional[dict]:
+    """Get the schema of an operation's parameters from the standard operations.
+
+    Returns None if the operation or its parameters are not defined.
+    """
+    operation = operations.get(operation_id)
+    if operation is None or "properties" not in operation:
+        return None
+    schema = operation["properties"].get("parameters")
+    if schema is None:
+        return {"properties": {}, "required": []}
+    return _resolve_schema(schema, operations)
+
+
+def _resolve_schema(schema: dict, operations: dict) -> Optional[dict]:
+    if "properties" in schema:
+        return schema
+    if "$ref" in schema:
+        # Definitions other than operations are kept by their name
+        definition = operations.get(schema["$ref"].rsplit("/", 1)[-1])
+        if definition is None:
+            return None
+        return {
+            "properties": definition.get("properties", {}),
+            "required": definition.get("required", []),
+        }
+    for combinator in ("allOf", "anyOf", "oneOf"):
+        for option in schema.get(combinator, []):
+            if option.get("type") == "null":
+                continue
+            resolved = _resolve_schema(option, operations)
+            if resolved is not None:
+                return resolved
+    return None
+
+
+def resolve_parameters(operation_id: str, parameters: dict, operations: dict) -> Optional[dict]:
+    """Fill in an operation's parameter defaults.
+
+    Returns None if the parameters are not defined or a required one is missing.
+    """
+    schema = parameter_schema(operation_id, operations)
+    if schema is None:
+        return None
+    resolved = dict(parameters)
+    for name, prop in schema.get("properties", {}).items():
+        if name not in resolved and isinstance(prop, dict) and "default" in prop:
+            resolved[name] = prop["default"]
+    if any(name not in resolved for name in schema.get("required", [])):
+        return None
+    return resolved
+
+
+def run_local_operation(
+    operation: dict,
+    message: dict,
+    operations: dict,
+    logger: logging.Logger,
+) -> Optional[dict]:
+    """Run an operation in-process.
+
+    Returns None if the operation has to run on a service provider instead.
+    """
+    handler = HANDLERS.get(operation["id"])
+    if handler is None:
+        return None
+    parameters = resolve_parameters(operation["id"], operation.get("parameters") or {}, operations)
+    if parameters is None:
+        logger.debug("No usable parameter definitions for operation '%s', running it remotely", operation["id"])
+        return None
+    try:
+        result = handler(message, parameters)
+    except Exception as e:
+        logger.warning({
+            "message": f"Failed to run operation '{operation['id']}' locally, running it remotely",
+            "error": str(e),
+        })
+        return None
+    logger.debug("Ran operation '%s' locally", operation["id"])
+    return result
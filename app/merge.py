@@ -0,0 +1,226 @@
+"""Merge TRAPI messages as plain dicts."""
+import hashlib
+from typing import Optional
+
+from .util import canonical_json
+
+
+def edge_key(edge: dict) -> str:
+    """Hash an edge by what makes it the same assertion.
+
+    Matches reasoner-pydantic: subject, object, predicate, qualifiers and
+    primary knowledge source.
+    """
+    primary_source = None
+    for source in edge.get("sources") or []:
+        if source.get("resource_role") == "primary_knowledge_source":
+            primary_source = source.get("resource_id")
+            break
+    qualifiers = sorted(canonical_json(qualifier) for qualifier in edge.get("qualifiers") or [])
+    return hashlib.blake2b(
+        canonical_json([
+            edge["subject"],
+            edge["object"],
+            edge["predicate"],
+            qualifiers,
+            primary_source,
+        ]).encode(),
+        digest_size=6,
+    ).hexdigest()
+
+
+def bindings_key(bindings: dict) -> tuple:
+    """Hash a mapping of query ids to lists of bindings, ignoring order."""
+    return tuple(sorted(
+        (key, tuple(sorted(canonical_json(binding) for binding in values)))
+        for key, values in bindings.items()
+    ))
+
+
+def analysis_key(analysis: dict) -> tuple:
+    """Hash an analysis the way reasoner-pydantic compares them."""
+    return (
+        analysis.get("resource_id"),
+        bindings_key(analysis.get("edge_bindings") or {}),
+        analysis.get("score"),
+        tuple(sorted(analysis.get("support_graphs") or [])),
+        analysis.get("scoring_method"),
+    )
+
+
+class _UniqueList:
+    """List that only takes values not seen before, keyed by canonical JSON."""
+
+    __slots__ = ("values", "keys")
+
+    def __init__(self, values=None):
+        self.values = []
+        self.keys = set()
+        self.extend(values or [])
+
+    def extend(self, values):
+        for value in values:
+            key = value if isinstance(value, str) else canonical_json(value)
+            if key not in self.keys:
+                self.keys.add(key)
+                self.values.append(value)
+
+
+class MessageMerger:
+    """Merge TRAPI messages in roughly linear time.
+
+    Knowledge graph nodes, edges, auxiliary graphs and results are kept in
+    hash indexes, so every incoming element is merged with a dict lookup
+    instead of a scan. Edge ids are rewritten to a hash of the edge, like
+    reasoner-pydantic does, so equivalent edges from different services
+    collapse. Incoming messages are never modified.
+    """
+
+    def __init__(self, query_graph: dict):
+        """Initialize."""
+        self.query_graph = query_graph
+        self.nodes = {}
+        self.edges = {}
+        self.auxiliary_graphs = None
+        self.results = None
+        self.has_kgraph = False
+        # Sets of merged list members, built when an element is first merged
+        self._node_lists = {}
+        self._edge_lists = {}
+        self._analyses = {}
+
+    def update(self, message: dict):
+        """Merge a message into the merged message."""
+        edge_ids = {}
+        kgraph = message.get("knowledge_graph")
+        if kgraph:
+            self.has_kgraph = True
+            for node_id, node in (kgraph.get("nodes") or {}).items():
+                self._add_node(node_id, node)
+            for edge_id, edge in (kgraph.get("edges") or {}).items():
+                edge_ids[edge_id] = self._add_edge(edge)
+
+        auxgraphs = message.get("auxiliary_graphs")
+        if auxgraphs is not None:
+            if self.auxiliary_graphs is None:
+                self.auxiliary_graphs = {}
+            for auxgraph_id, auxgraph in auxgraphs.items():
+                self.auxiliary_graphs[auxgraph_id] = {
+                    **auxgraph,
+                    "edges": list(dict.fromkeys(
+                        edge_ids.get(edge_id, edge_id)
+                        for edge_id in auxgraph.get("edges") or []
+                    )),
+                }
+
+        results = message.get("results")
+        if results is not None:
+            if self.results is None:
+                self.results = {}
+            for result in results:
+                self._add_result(result, edge_ids)
+
+    def _add_node(self, node_id: str, node: dict):
+        existing = self.nodes.get(node_id)
+        if existing is None:
+            self.nodes[node_id] = dict(node)
+            return
+        lists = self._node_lists.get(node_id)
+        if lists is None:
+            lists = self._node_lists[node_id] = {
+                "categories": _UniqueList(existing.get("categories")),
+                "attributes": _UniqueList(existing.get("attributes")),
+            }
+        if node.get("name"):
+            existing["name"] = node["name"]
+        for field, values in lists.items():
+            if node.get(field):
+                values.extend(node[field])
+                existing[field] = values.values
+
+    def _add_edge(self, edge: dict) -> str:
+        key = edge_key(edge)
+        existing = self.edges.get(key)
+        if existing is None:
+            self.edges[key] = dict(edge)
+            return key
+        lists = self._edge_lists.get(key)
+        if lists is None:
+            lists = self._edge_lists[key] = {
+                "attributes": _UniqueList(existing.get("attributes")),
+                "sources": {
+                    (source["resource_id"], source["resource_role"]): source
+                    for source in existing.get("sources") or []
+                },
+            }
+        if edge.get("attributes"):
+            lists["attributes"].extend(edge["attributes"])
+            existing["attributes"] = lists["attributes"].values
+        if edge.get("sources"):
+            sources = lists["sources"]
+            for source in edge["sources"]:
+                source_key = (source["resource_id"], source["resource_role"])
+                current = sources.get(source_key)
+                if current is None:
+                    sources[source_key] = source
+                elif source.get("upstream_resource_ids"):
+                    sources[source_key] = {
+                        **current,
+                        "upstream_resource_ids": list(dict.fromkeys(
+                            (current.get("upstream_resource_ids") or [])
+                            + source["upstream_resource_ids"]
+                        )),
+                    }
+            existing["sources"] = list(sources.values())
+        return key
+
+    def _add_result(self, result: dict, edge_ids: dict[str, str]):
+        key = bindings_key(result["node_bindings"])
+        existing = self.results.get(key)
+        if existing is None:
+            existing = self.results[key] = {**result, "analyses": []}
+            self._analyses[key] = {}
+        analyses = self._analyses[key]
+        for analysis in result.get("analyses") or []:
+            if edge_ids:
+                analysis = {
+                    **analysis,
+                    "edge_bindings": {
+                        qedge_id: [
+                            {**binding, "id": edge_ids.get(binding["id"], binding["id"])}
+                            for binding in bindings
+                        ]
+                        for qedge_id, bindings in (analysis.get("edge_bindings") or {}).items()
+                    },
+                }
+            akey = analysis_key(analysis)
+            current = analyses.get(akey)
+            if current is None:
+                analyses[akey] = analysis = dict(analysis)
+                existing["analyses"].append(analysis)
+                continue
+            for field in ("attributes", "support_graphs"):
+                if analysis.get(field):
+                    current[field] = _UniqueList(
+                        (current.get(field) or []) + analysis[field]
+                    ).values
+
+    def to_message(self) -> dict:
+        """Get the merged message."""
+        kgraph: Optional[dict] = None
+        if self.has_kgraph:
+            kgraph = {"nodes": self.nodes, "edges": self.edges}
+        return {
+            "query_graph": self.query_graph,
+            "knowledge_graph": kgraph,
+            "results": None if self.results is None else list(self.results.values()),
+            "auxiliary_graphs": self.auxiliary_graphs,
+        }
+
+
+def merge_messages(query_graph: dict, messages: list[dict]) -> dict:
+    """Merge messages answering the same query graph."""
+    merger = MessageMerger(query_graph)
+    for message in messages:
+        merger.update(message)
+    return merger.to_message()
@@ -0,0 +1,286 @@
+"""Prometheus metrics.
+
+Metrics are kept in-process and rendered in the Prometheus text exposition
+format, so each worker process reports its own.
+"""
+from bisect import bisect_left
+import time
+from typing import Iterable
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(4 ** exponent for exponent in range(5, 16))  # 1 KiB to 1 GiB
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'),
+        )
+        for name, value in zip(names, values)
+    ) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Metric with a value per combination of label values."""
+
+    type = ""
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        """Initialize."""
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> Iterable[tuple[str, tuple, tuple, float]]:
+        for key, value in self.values.items():
+            yield self.name, self.labels, key, value
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, label_names, label_values, value in self.samples():
+            lines.append(f"{name}{_format_labels(label_names, label_values)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that goes up and down."""
+
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Distribution of observations over fixed buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Iterable[str] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        """Initialize."""
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self.values.get(key)
+        if counts is None:
+            # Per-bucket counts, then the sum of all observations
+            counts = self.values[key] = [0] * len(self.buckets) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, **labels) -> "_Timer":
+        """Time a block of code."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        names = self.labels + ("le",)
+        for key, counts in self.values.items():
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                yield self.name + "_bucket", names, key + (_format_value(bound),), total
+            yield self.name + "_sum", self.labels, key, counts[-1]
+            yield self.name + "_count", self.labels, key, total
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class CacheMetric(Metric):
+    """Statistic of the named in-process caches, read from them when rendered.
+
+    Caches count their own hits and misses, so lookups cost nothing extra.
+    """
+
+    def __init__(self, name: str, description: str, stat: str, type: str):
+        """Initialize."""
+        super().__init__(name, description, ("cache",))
+        self.stat = stat
+        self.type = type
+
+    def samples(self):
+        for cache_name, cache in CACHES.items():
+            yield self.name, self.labels, (cache_name,), cache.stats()[self.stat]
+
+
+class Registry:
+    """Collection of metrics."""
+
+    def __init__(self):
+        """Initialize."""
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format."""
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# In-process caches reported by name, the latest cache of each name is kept
+CACHES = {}
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "wfr_http_requests_total",
+    "HTTP requests handled, by handler and status code.",
+    ("handler", "method", "status"),
+))
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "wfr_http_request_duration_seconds",
+    "Time to handle an HTTP request, including streaming the response.",
+    ("handler",),
+))
+HTTP_RESPONSE_SIZE = REGISTRY.register(Histogram(
+    "wfr_http_response_size_bytes",
+    "Size of HTTP response bodies.",
+    ("handler",),
+    buckets=SIZE_BUCKETS,
+))
+HTTP_IN_PROGRESS = REGISTRY.register(Gauge(
+    "wfr_http_requests_in_progress",
+    "HTTP requests being handled.",
+))
+WORKFLOWS_IN_PROGRESS = REGISTRY.register(Gauge(
+    "wfr_workflows_in_progress",
+    "Workflows being run, synchronous and asynchronous.",
+))
+UPSTREAM_REQUESTS = REGISTRY.register(Counter(
+    "wfr_upstream_requests_total",
+    "Requests to upstream services, by outcome: success, error or cancelled.",
+    ("service", "operation", "outcome"),
+))
+UPSTREAM_DURATION = REGISTRY.register(Histogram(
+    "wfr_upstream_request_duration_seconds",
+    "Time for an upstream service to respond.",
+    ("service", "operation"),
+))
+UPSTREAM_RESPONSE_SIZE = REGISTRY.register(Histogram(
+    "wfr_upstream_response_size_bytes",
+    "Size of upstream response bodies.",
+    ("service",),
+    buckets=SIZE_BUCKETS,
+))
+UPSTREAM_COALESCED = REGISTRY.register(Counter(
+    "wfr_upstream_coalesced_total",
+    "Upstream requests shared with an identical one already in flight.",
+    ("service",),
+))
+CACHE_HITS = REGISTRY.register(CacheMetric(
+    "wfr_cache_hits_total",
+    "Lookups found in in-process caches: normalizer, response and routing_plans.",
+    "hits",
+    "counter",
+))
+CACHE_MISSES = REGISTRY.register(CacheMetric(
+    "wfr_cache_misses_total",
+    "Lookups missing from in-process caches, or expired.",
+    "misses",
+    "counter",
+))
+CACHE_ENTRIES = REGISTRY.register(CacheMetric(
+    "wfr_cache_entries",
+    "Entries in in-process caches.",
+    "size",
+    "gauge",
+))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "wfr_stage_duration_seconds",
+    "Time spent in each stage of a query: admission, upstream_queue, normalize, validate, merge or compact.",
+    ("stage",),
+))
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting and timing HTTP requests.
+
+    Requests are labelled by the name of the endpoint that handled them, so
+    paths with ids in them do not each get their own series.
+    """
+
+    def __init__(self, app):
+        """Initialize."""
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "none")
+            HTTP_REQUESTS.inc(handler=handler, method=scope["method"], status=status)
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, handler=handler)
+            HTTP_RESPONSE_SIZE.observe(size, handler=handler)
@@ -1,5 +1,12 @@
 """Pydantic models."""
-from pydantic import BaseModel
+from typing import Optional, Union
+
+from pydantic import BaseModel, Field, create_model
+import reasoner_pydantic
+from reasoner_pydantic import workflow
+from reasoner_pydantic.base_model import BaseModel as TRAPIBaseModel
+from reasoner_pydantic.utils import HashableSequence
+
 
 class Services(BaseModel):
     """Services info."""
@@ -8,3 +15,87 @@ class Services(BaseModel):
 class Operations(BaseModel):
     """Operations List."""
     __root__: dict[str, dict]
+
+
+class RunnerOptions(BaseModel):
+    """Workflow runner options, on top of the TRAPI runner_parameters."""
+    bypass_cache: Optional[bool] = Field(
+        None,
+        description="Skip the upstream response cache for this operation.",
+    )
+    local: Optional[bool] = Field(
+        None,
+        description="Run the operation in the workflow runner when it can, instead of on a service provider.",
+    )
+    compact: Optional[bool] = Field(
+        None,
+        description="Drop knowledge graph elements and auxiliary graphs no result uses after the operation.",
+    )
+
+
+class RunnerAllowList(workflow.RunnerAllowList, RunnerOptions):
+    """Allowlist runner parameters."""
+
+    class Config:
+        extra = "forbid"
+
+
+class RunnerDenyList(workflow.RunnerDenyList, RunnerOptions):
+    """Denylist runner parameters."""
+
+    class Config:
+        extra = "forbid"
+
+
+class RunnerTimeout(workflow.RunnerTimeout, RunnerOptions):
+    """Timeout runner parameters."""
+
+    class Config:
+        extra = "forbid"
+
+
+class RunnerParameters(TRAPIBaseModel):
+    """TRAPI runner_parameters, with the workflow runner options."""
+    __root__: Optional[Union[RunnerAllowList, RunnerDenyList, RunnerTimeout]]
+
+
+def with_runner_options(operation: type) -> type:
+    """Extend a reasoner-pydantic operation model to accept the runner options.
+
+    reasoner-pydantic forbids unknown runner_parameters. Its own models are
+    left as they are, and the request models below refer to the extended ones.
+    """
+    return create_model(
+        operation.__name__,
+        __base__=operation,
+        __module__=__name__,
+        runner_parameters=(Optional[RunnerParameters], None),
+    )
+
+
+OPERATION_MODELS = [with_runner_options(operation) for operation in workflow.operations]
+
+
+class Operation(TRAPIBaseModel):
+    """TRAPI operation."""
+    __root__: Union[tuple(OPERATION_MODELS)]
+
+
+class Workflow(TRAPIBaseModel):
+    """TRAPI workflow."""
+    __root__: HashableSequence[Operation]
+
+
+class Query(reasoner_pydantic.Query):
+    """Request."""
+    workflow: Optional[Workflow]
+
+
+class AsyncQuery(reasoner_pydantic.AsyncQuery):
+    """AsyncQuery."""
+    workflow: Optional[Workflow]
+
+
+class Response(reasoner_pydantic.Response):
+    """Response."""
+    workflow: Optional[Workflow]
@@ -0,0 +1,227 @@
+"""Node normalization with a CURIE cache in front of the node normalizer."""
+import asyncio
+import logging
+import os
+from typing import Optional
+
+import httpx
+
+from .cache import LRUCache, MISSING
+from .util import canonical_json, post_safely
+
+NORMALIZER_CACHE_SIZE = int(os.getenv("NORMALIZER_CACHE_SIZE", 200_000))
+NORMALIZER_CACHE_TTL = float(os.getenv("NORMALIZER_CACHE_TTL", 24 * 60 * 60))
+NORMALIZER_BATCH_SIZE = int(os.getenv("NORMALIZER_BATCH_SIZE", 1000))
+
+
+class NodeNormalizer:
+    """Node normalizer client.
+
+    Equivalences are looked up with /get_normalized_nodes, once per batch of
+    messages, and cached per CURIE so that known identifiers are never sent
+    upstream again. The results are applied to TRAPI messages locally.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        cache_size: int = NORMALIZER_CACHE_SIZE,
+        cache_ttl: float = NORMALIZER_CACHE_TTL,
+        batch_size: int = NORMALIZER_BATCH_SIZE,
+    ):
+        """Initialize."""
+        self.url = url
+        self.cache = LRUCache(cache_size, cache_ttl, name="normalizer")
+        self.batch_size = batch_size
+
+    async def get_normalized_nodes(
+        self,
+        curies: list[str],
+        client: Optional[httpx.AsyncClient] = None,
+        timeout: Optional[float] = 60.0,
+        logger: Optional[logging.Logger] = None,
+    ) -> dict[str, Optional[dict]]:
+        """Look up the normalized nodes for CURIEs.
+
+        CURIEs that could not be looked up are left out of the result.
+        """
+        if not logger:
+            logger = logging.getLogger(__name__)
+        normalized = {}
+        misses = []
+        for curie in curies:
+            node = self.cache.get(curie)
+            if node is MISSING:
+                misses.append(curie)
+            else:
+                normalized[curie] = node
+
+        batches = [
+            misses[i:i + self.batch_size]
+            for i in range(0, len(misses), self.batch_size)
+        ]
+        responses = await asyncio.gather(*(
+            post_safely(
+                self.url + "/get_normalized_nodes",
+                {"curies": batch},
+                client=client,
+                timeout=timeout,
+                logger=logger,
+                service_name="node_normalizer",
+                validation=None,
+            )
+            for batch in batches
+        ), return_exceptions=True)
+        for batch, response in zip(batches, responses):
+            if isinstance(response, RuntimeError):
+                logger.warning({
+                    "error": str(response)
+                })
+                continue
+            if isinstance(response, BaseException):
+                raise response
+            for curie in batch:
+                node = response.get(curie)
+                self.cache.set(curie, node)
+                normalized[curie] = node
+
+        logger.debug(
+            "Normalized %d CURIEs: %d cached, %d sent to node normalizer in %d batches",
+            len(curies),
+            len(curies) - len(misses),
+            len(misses),
+            len(batches),
+        )
+        return normalized
+
+    async def normalize_messages(
+        self,
+        messages: list[dict],
+        client: Optional[httpx.AsyncClient] = None,
+        timeout: Optional[float] = 60.0,
+        logger: Optional[logging.Logger] = None,
+    ) -> list[dict]:
+        """Normalize TRAPI messages with a single lookup over all of their CURIEs.
+
+        The input messages are not modified.
+        """
+        curies = {}
+        for message in messages:
+            for curie in message_curies(message):
+                curies[curie] = None
+        if not curies:
+            return messages
+        normalized = await self.get_normalized_nodes(list(curies), client, timeout, logger)
+        return [
+            apply_normalization(message, normalized)
+            for message in messages
+        ]
+
+
+def message_curies(message: dict):
+    """Iterate over the knowledge graph and result node ids of a message."""
+    kgraph = message.get("knowledge_graph") or {}
+    yield from kgraph.get("nodes") or {}
+    for result in message.get("results") or []:
+        for bindings in result["node_bindings"].values():
+            for binding in bindings:
+                yield binding["id"]
+
+
+def normalize_node(node: dict, normalized: dict) -> dict:
+    """Apply a normalized node to a knowledge graph node."""
+    same_as = {
+        "attribute_type_id": "biolink:same_as",
+        "original_attribute_name": "equivalent_identifiers",
+        "value": [
+            identifier["identifier"]
+            for identifier in normalized.get("equivalent_identifiers") or []
+        ],
+        "value_type_id": "metatype:uriorcurie",
+    }
+    return {
+        **node,
+        "name": normalized["id"].get("label") or node.get("name"),
+        "categories": normalized.get("type") or node.get("categories"),
+        "attributes": [
+            attribute
+            for attribute in node.get("attributes") or []
+            if attribute.get("attribute_type_id") != "biolink:same_as"
+        ] + [same_as],
+    }
+
+
+def merge_nodes(node: dict, other: dict) -> dict:
+    """Merge two knowledge graph nodes that normalized to the same identifier."""
+    categories = list(dict.fromkeys(
+        (node.get("categories") or []) + (other.get("categories") or [])
+    ))
+    attributes = {
+        canonical_json(attribute): attribute
+        for attribute in (node.get("attributes") or []) + (other.get("attributes") or [])
+    }
+    return {
+        **other,
+        **node,
+        "name": node.get("name") or other.get("name"),
+        "categories": categories,
+        "attributes": list(attributes.values()),
+    }
+
+
+def apply_normalization(message: dict, normalized: dict[str, Optional[dict]]) -> dict:
+    """Rewrite a message in terms of preferred identifiers.
+
+    Returns a new message, the input is left untouched.
+    """
+    preferred = {
+        curie: node["id"]["identifier"]
+        for curie, node in normalized.items()
+        if node
+    }
+    message = dict(message)
+
+    kgraph = message.get("knowledge_graph")
+    if kgraph:
+        nodes = {}
+        for curie, node in (kgraph.get("nodes") or {}).items():
+            if normalized.get(curie):
+                node = normalize_node(node, normalized[curie])
+            node_id = preferred.get(curie, curie)
+            nodes[node_id] = merge_nodes(nodes[node_id], node) if node_id in nodes else node
+        edges = {}
+        for edge_id, edge in (kgraph.get("edges") or {}).items():
+            subject_id = preferred.get(edge["subject"], edge["subject"])
+            object_id = preferred.get(edge["object"], edge["object"])
+            if subject_id != edge["subject"] or object_id != edge["object"]:
+                edge = {**edge, "subject": subject_id, "object": object_id}
+            edges[edge_id] = edge
+        message["knowledge_graph"] = {**kgraph, "nodes": nodes, "edges": edges}
+
+    if message.get("results"):
+        qnodes = (message.get("query_graph") or {}).get("nodes") or {}
+        message["results"] = [
+            normalize_result(result, preferred, qnodes)
+            for result in message["results"]
+        ]
+
+    return message
+
+
+def normalize_result(result: dict, preferred: dict[str, str], qnodes: dict) -> dict:
+    """Rewrite the node bindings of a result in terms of preferred identifiers."""
+    node_bindings = {}
+    for qnode_id, bindings in result["node_bindings"].items():
+        qnode_ids = (qnodes.get(qnode_id) or {}).get("ids") or []
+        normalized_bindings = {}
+        for binding in bindings:
+            node_id = preferred.get(binding["id"], binding["id"])
+            if node_id != binding["id"]:
+                original_id = binding["id"]
+                binding = {**binding, "id": node_id}
+                # Keep track of the pinned CURIE the binding answers
+                if binding.get("query_id") is None and original_id in qnode_ids:
+                    binding["query_id"] = original_id
+            normalized_bindings[canonical_json(binding)] = binding
+        node_bindings[qnode_id] = list(normalized_bindings.values())
+    return {**result, "node_bindings": node_bindings}
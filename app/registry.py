@@ -0,0 +1,161 @@
+"""Service registry snapshots."""
+import asyncio
+import copy
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Optional
+
+import httpx
+
+from .discovery import discover_services
+from .smartapi import SmartAPI
+from .standard_operations import StandardOperations
+
+LOGGER = logging.getLogger(__name__)
+
+# Where the resolved services and operations are kept between restarts,
+# empty to not keep them
+REGISTRY_SNAPSHOT_PATH = os.getenv(
+    "REGISTRY_SNAPSHOT_PATH",
+    os.path.join(tempfile.gettempdir(), "workflow-runner-registry.json"),
+)
+# Seconds between background refreshes, 0 to only refresh on startup and /refresh
+REGISTRY_REFRESH_INTERVAL = float(os.getenv("REGISTRY_REFRESH_INTERVAL", 60 * 60))
+# Share the snapshot between the workers of a server, set by gunicorn.conf.py
+REGISTRY_SHARED = os.getenv("REGISTRY_SHARED", "false").lower() == "true"
+# Seconds between checks for snapshots saved by other workers, when shared
+REGISTRY_WATCH_INTERVAL = float(os.getenv("REGISTRY_WATCH_INTERVAL", 5))
+
+# Held by the one worker that refreshes a shared snapshot
+REFRESH_LOCK = None
+
+
+def fetch_json(url: str, etag: Optional[str] = None) -> tuple[Optional[dict], Optional[str]]:
+    """GET a JSON document, unless it still has the given ETag.
+
+    Returns the document, or None if it is unchanged, and its ETag.
+    """
+    headers = {"accept": "application/json"}
+    if etag:
+        headers["if-none-match"] = etag
+    response = httpx.get(url, headers=headers)
+    if etag and response.status_code == 304:
+        return None, etag
+    response.raise_for_status()
+    return response.json(), response.headers.get("etag")
+
+
+def load_snapshot(path: Optional[str], config: dict) -> Optional[dict]:
+    """Load a snapshot taken with the same configuration."""
+    if not path:
+        return None
+    try:
+        with open(path) as stream:
+            snapshot = json.load(stream)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get("config") != config:
+        return None
+    return snapshot
+
+
+def save_snapshot(path: Optional[str], snapshot: dict):
+    """Save a snapshot, replacing the previous one atomically.
+
+    Failures are logged, the snapshot is served anyway.
+    """
+    if not path:
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    stream = None
+    try:
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as stream:
+            json.dump(snapshot, stream)
+        os.replace(stream.name, path)
+    except OSError as e:
+        LOGGER.warning("Failed to save the registry snapshot to %s: %s", path, e)
+        if stream is not None and os.path.exists(stream.name):
+            os.remove(stream.name)
+
+
+def snapshot_version(path: Optional[str]) -> Optional[int]:
+    """Get the modification time of a snapshot, which changes when it is replaced."""
+    if not path:
+        return None
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def acquire_refresh_lock(path: str) -> bool:
+    """Try to become the worker that refreshes a shared snapshot.
+
+    The lock is kept until the process exits, then another worker takes over.
+    """
+    global REFRESH_LOCK
+    if REFRESH_LOCK is None:
+        try:
+            stream = open(path + ".lock", "a")
+        except OSError as e:
+            # Without a lock to share, every worker refreshes on its own
+            LOGGER.warning("Failed to open the registry refresh lock %s.lock: %s", path, e)
+            return True
+        try:
+            fcntl.flock(stream, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            stream.close()
+            return False
+        REFRESH_LOCK = stream
+    return True
+
+
+async def refresh_registry(
+    smartapi: SmartAPI,
+    standard_operations: StandardOperations,
+    config: dict,
+    previous: Optional[dict],
+    logger: logging.Logger,
+) -> dict:
+    """Resolve services and operations into a new snapshot.
+
+    Registry documents are fetched conditionally on the ETags in the previous
+    snapshot; unchanged ones are reused from it. Endpoints are always probed
+    again.
+    """
+    previous = previous or {}
+    etags = previous.get("etags", {})
+
+    # The registry clients are synchronous, keep them off the event loop
+    response_dict, smartapi_etag = await asyncio.to_thread(fetch_json, smartapi.query_url, etags.get("smartapi"))
+    if response_dict is None:
+        logger.debug("SmartAPI registry is unchanged")
+        endpoints = previous["endpoints"]
+    else:
+        endpoints = SmartAPI.filter_operations_endpoints(smartapi.parse_trapi_endpoints(response_dict))
+
+    response_dict, operations_etag = await asyncio.to_thread(
+        fetch_json,
+        standard_operations.base_url,
+        etags.get("operations"),
+    )
+    if response_dict is None:
+        logger.debug("Operations schema is unchanged")
+        operations = previous["operations"]
+    else:
+        operations = StandardOperations.parse_operations(response_dict)
+
+    # Discovery modifies the endpoints, keep the registry's version
+    services = await discover_services(copy.deepcopy(endpoints), logger)
+    return {
+        "config": config,
+        "created": time.time(),
+        "etags": {"smartapi": smartapi_etag, "operations": operations_etag},
+        "endpoints": endpoints,
+        "operations": operations,
+        "services": services,
+    }
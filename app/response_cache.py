@@ -0,0 +1,130 @@
+"""Upstream response cache."""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from .cache import LRUCache, MISSING
+from .util import canonical_json
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 60 * 60))
+# Per-operation TTLs in seconds, e.g. '{"lookup": 86400, "annotate_nodes": 0}'
+RESPONSE_CACHE_TTLS = json.loads(os.getenv("RESPONSE_CACHE_TTLS", "{}"))
+# SQLite file for the optional on-disk tier
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH")
+
+
+def cache_key(message: dict, operation: dict, url: str) -> str:
+    """Hash an outgoing request canonically."""
+    return hashlib.sha256(canonical_json({
+        "message": message,
+        "operation": operation,
+        "url": url,
+    }).encode()).hexdigest()
+
+
+class SQLiteStore:
+    """On-disk cache tier."""
+
+    def __init__(self, path: str):
+        """Initialize."""
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connect in each process, a connection must not be used across a fork
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._pid = os.getpid()
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses "
+                    "(key TEXT PRIMARY KEY, expires REAL, value BLOB)"
+                )
+                self._connection.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+        return self._connection
+
+    def get(self, key: str) -> Optional[tuple[bytes, float]]:
+        """Get an unexpired value and its remaining TTL."""
+        now = time.time()
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value, expires FROM responses WHERE key = ? AND expires >= ?",
+                (key, now),
+            ).fetchone()
+        return (row[0], row[1] - now) if row else None
+
+    def set(self, key: str, value: bytes, ttl: float):
+        """Store a value."""
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (key, time.time() + ttl, value),
+            )
+
+
+class ResponseCache:
+    """Two-tier cache of upstream responses.
+
+    Hits are served from an in-memory LRU first, then from the optional
+    SQLite tier. Cached responses are shared between requests and must not
+    be modified.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL,
+        ttls: Optional[dict[str, float]] = None,
+        path: Optional[str] = RESPONSE_CACHE_PATH,
+    ):
+        """Initialize."""
+        self.ttl = ttl
+        self.ttls = RESPONSE_CACHE_TTLS if ttls is None else ttls
+        self.memory = LRUCache(maxsize, name="response")
+        self.disk = SQLiteStore(path) if path else None
+
+    def ttl_for(self, operation_id: str) -> float:
+        """Get the TTL of an operation's responses, 0 to not cache them."""
+        return float(self.ttls.get(operation_id, self.ttl))
+
+    async def get(self, key: str) -> Optional[dict]:
+        """Get a cached response."""
+        response = self.memory.get(key)
+        if response is not MISSING:
+            return response
+        if self.disk is None:
+            return None
+        row = await asyncio.to_thread(self._load, key)
+        if row is None:
+            return None
+        response, ttl = row
+        self.memory.set(key, response, ttl=ttl)
+        return response
+
+    def _load(self, key: str) -> Optional[tuple[dict, float]]:
+        row = self.disk.get(key)
+        if row is None:
+            return None
+        value, ttl = row
+        return json.loads(value), ttl
+
+    def _store(self, key: str, response: dict, ttl: float):
+        self.disk.set(key, json.dumps(response).encode(), ttl)
+
+    async def set(self, key: str, response: dict, operation_id: str):
+        """Cache a response."""
+        ttl = self.ttl_for(operation_id)
+        if ttl <= 0:
+            return
+        self.memory.set(key, response, ttl=ttl)
+        if self.disk is not None:
+            await asyncio.to_thread(self._store, key, response, ttl)
@@ -0,0 +1,79 @@
+"""Service routing."""
+import os
+from typing import Iterable, Optional
+
+from .cache import LRUCache, MISSING
+
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", 1024))
+
+
+def selection_key(operation_id: str, runner_parameters: dict) -> tuple:
+    """Hash the parts of an operation that decide which services run it."""
+    allowlist = runner_parameters.get("allowlist")
+    denylist = runner_parameters.get("denylist")
+    return (
+        operation_id,
+        None if allowlist is None else frozenset(allowlist),
+        None if denylist is None else frozenset(denylist),
+    )
+
+
+class RoutingTable:
+    """Services indexed by operation and infores.
+
+    Built once per refresh of the services table. Service selection for a
+    whole workflow is cached, so a table must be replaced, not modified,
+    when the services change.
+    """
+
+    def __init__(self, services: dict[str, list[dict]], plan_cache_size: int = PLAN_CACHE_SIZE):
+        """Initialize."""
+        self.services = {
+            operation_id: tuple(operation_services)
+            for operation_id, operation_services in services.items()
+        }
+        # Registry positions of each infores' services, per operation
+        self.positions: dict[str, dict[str, list[int]]] = {}
+        for operation_id, operation_services in self.services.items():
+            positions = self.positions[operation_id] = {}
+            for position, service in enumerate(operation_services):
+                positions.setdefault(service["infores"], []).append(position)
+        self.plans = LRUCache(plan_cache_size, name="routing_plans")
+
+    def select(
+        self,
+        operation_id: str,
+        allowlist: Optional[Iterable[str]] = None,
+        denylist: Optional[Iterable[str]] = None,
+    ) -> tuple[dict, ...]:
+        """Get the services for an operation, in registry order.
+
+        An allowlist takes precedence over a denylist.
+        """
+        services = self.services.get(operation_id, ())
+        if allowlist is not None:
+            positions = self.positions.get(operation_id, {})
+            return tuple(
+                services[position]
+                for position in sorted(
+                    position
+                    for infores in set(allowlist)
+                    for position in positions.get(infores, ())
+                )
+            )
+        if denylist is not None:
+            denylist = set(denylist)
+            return tuple(service for service in services if service["infores"] not in denylist)
+        return services
+
+    def plan(self, workflow: list[dict]) -> list[tuple[dict, ...]]:
+        """Get the services for each operation of a workflow."""
+        keys = tuple(
+            selection_key(operation["id"], operation.get("runner_parameters") or {})
+            for operation in workflow
+        )
+        plan = self.plans.get(keys)
+        if plan is MISSING:
+            plan = [self.select(*key) for key in keys]
+            self.plans.set(keys, plan)
+        return plan
@@ -0,0 +1,33 @@
+"""Fast JSON serialization of TRAPI responses."""
+import json
+from typing import Any
+
+from pydantic.json import pydantic_encoder
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """Serialize to JSON, with orjson if it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=pydantic_encoder, option=orjson.OPT_SORT_KEYS if sort_keys else None)
+    return json.dumps(obj, default=pydantic_encoder, separators=(",", ":"), sort_keys=sort_keys).encode()
+
+
+class FastJSONResponse(Response):
+    """JSON response that is serialized as is.
+
+    Returning a starlette Response from a route makes FastAPI skip validating
+    and encoding it against the route's response_model, which still
+    documents the response in the OpenAPI schema. Only use it for content
+    the runner built itself.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,25 +1,55 @@
 """Workflow runner."""
-from app.models import Services, Operations
+from app.models import AsyncQuery, Operations, Query as ReasonerQuery, Response, Services
+import asyncio
 from collections import defaultdict
 import logging
 import os
+import time
+from typing import AsyncIterator, Optional
 
-from fastapi import Body, HTTPException
+from fastapi import Body, HTTPException, Request
 import httpx
-from pydantic import HttpUrl, ValidationError
-from pydantic.tools import parse_obj_as
-from reasoner_pydantic import Query as ReasonerQuery, Response
+from pydantic import ValidationError
+from reasoner_pydantic import AsyncQueryResponse, AsyncQueryStatusResponse
 from reasoner_pydantic import Message, QueryGraph, KnowledgeGraph, Results, AuxiliaryGraphs
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import PlainTextResponse, StreamingResponse
 
+from .admission import QUERY_RETRY_AFTER, AdmissionQueue
+from .compression import RESPONSE_COMPRESSION, CompressionMiddleware
+from .discovery import discover_services
+from .health import HealthTracker
+from .http_client import client_session, open_client, close_client
+from .jobs import JobQueue
+from .local_operations import COMPACT_MESSAGES, LOCAL_OPERATIONS, compact_message, run_local_operation
+from .metrics import REGISTRY, STAGE_DURATION, WORKFLOWS_IN_PROGRESS, MetricsMiddleware
+from .normalizer import NodeNormalizer
+from .serialization import FastJSONResponse, dumps
+from .response_cache import RESPONSE_CACHE_ENABLED, ResponseCache, cache_key
 from .wfr_logging import gen_logger
-from .util import load_example, drop_nulls, post_safely
+from .util import RequestTiming, load_example, drop_nulls, post_safely
+from .merge import merge_messages
+from .validation import UPSTREAM_VALIDATION, parse_message, should_validate
 from .trapi import TRAPI
-from .smartapi import SmartAPI
-from .standard_operations import StandardOperations
+from .registry import (
+    REGISTRY_REFRESH_INTERVAL,
+    REGISTRY_SHARED,
+    REGISTRY_SNAPSHOT_PATH,
+    REGISTRY_WATCH_INTERVAL,
+    acquire_refresh_lock,
+    load_snapshot,
+    refresh_registry,
+    save_snapshot,
+    snapshot_version,
+)
+from .routing import RoutingTable
+from .smartapi import SMARTAPI_URL, SmartAPI
+from .standard_operations import OPERATIONS_SCHEMA_URL, StandardOperations
 
 LOGGER = logging.getLogger(__name__)
 
+NDJSON = "application/x-ndjson"
+
 openapi_args = dict(
     title="Workflow runner",
     version="1.7.1",
@@ -39,6 +69,10 @@ OPENAPI_SERVER_URL = os.getenv("OPENAPI_SERVER_URL")
 OPENAPI_SERVER_MATURITY = os.getenv("OPENAPI_SERVER_MATURITY", "development")
 OPENAPI_SERVER_LOCATION = os.getenv("OPENAPI_SERVER_LOCATION", "RENCI")
 TRAPI_VERSION = os.getenv("TRAPI_VERSION", "1.5.0")
+# Seconds a whole workflow may take, unless the query sets "timeout"
+WORKFLOW_TIMEOUT = float(os.getenv("WORKFLOW_TIMEOUT", 300))
+# Operations without a timeout of their own get at most this many seconds
+OPERATION_TIMEOUT = 60.0
 
 if OPENAPI_SERVER_URL:
     openapi_args["servers"] = [
@@ -53,6 +87,10 @@ openapi_args["trapi"] = TRAPI_VERSION
 
 APP = TRAPI(**openapi_args)
 
+APP.add_middleware(MetricsMiddleware)
+if RESPONSE_COMPRESSION:
+    APP.add_middleware(CompressionMiddleware)
+
 APP.add_middleware(
     CORSMiddleware,
     allow_origins=['*'],
@@ -61,6 +99,46 @@ APP.add_middleware(
     allow_headers=["*"],
 )
 
+
+@APP.on_event("startup")
+async def startup_http_client():
+    """Open the shared upstream HTTP client."""
+    await open_client()
+
+
+@APP.on_event("shutdown")
+async def shutdown_http_client():
+    """Close the shared upstream HTTP client."""
+    await close_client()
+
+
+# Node normalizer, with a CURIE cache shared by all requests.
+NORMALIZER = NodeNormalizer(NORMALIZER_URL)
+
+# Upstream response cache, opt-in.
+RESPONSE_CACHE = ResponseCache() if RESPONSE_CACHE_ENABLED else None
+HEALTH = HealthTracker()
+
+# Queries run at once, the rest wait in a bounded queue
+ADMISSION = AdmissionQueue()
+
+# Asynchronous queries, run by a pool of workers.
+# execute_workflow is defined below, look it up when a job runs
+JOBS = JobQueue(lambda request_dict, logger: execute_workflow(request_dict, logger))
+
+
+@APP.on_event("startup")
+async def start_jobs():
+    """Start the async query workers."""
+    await JOBS.start()
+
+
+@APP.on_event("shutdown")
+async def stop_jobs():
+    """Stop the async query workers."""
+    await JOBS.stop()
+
+
 # Global services dict.
 # It is set on app startup and on POST /refresh through a global reference.
 SERVICES = defaultdict(list)
@@ -68,6 +146,22 @@ SERVICES = defaultdict(list)
 # Global operations
 OPERATIONS = defaultdict(dict)
 
+# SERVICES indexed for service selection
+ROUTING = RoutingTable({})
+
+# The snapshot SERVICES and OPERATIONS were resolved from,
+# reused by the next refresh for conditional fetches.
+REGISTRY_SNAPSHOT = None
+REGISTRY_CONFIG = {
+    "smartapi": SMARTAPI_URL,
+    "operations": OPERATIONS_SCHEMA_URL,
+    "maturity": OPENAPI_SERVER_MATURITY,
+    "trapi": TRAPI_VERSION,
+}
+# Modification time of the snapshot file REGISTRY_SNAPSHOT was last saved to or loaded from
+SNAPSHOT_VERSION = None
+REGISTRY_TASKS = []
+
 @APP.post(
         "/query",
         tags=["trapi"],
@@ -84,127 +178,665 @@ OPERATIONS = defaultdict(dict)
         },
 )
 async def run_workflow(
+        raw_request: Request,
         request: ReasonerQuery = Body(..., example=load_example("query")),
 ) -> Response:
-    """Run workflow."""
+    """Run workflow.
+
+    With an Accept header of application/x-ndjson, or "stream": true in the
+    request, progress is streamed as newline-delimited JSON events.
+
+    If the client disconnects, the workflow is stopped and its upstream
+    requests are cancelled. Queries wait for their turn when too many run
+    at once, and are rejected with a 503 when too many are waiting.
+    """
     request_dict = request.dict(
         exclude_unset=True,
     )
-    
-    message = request_dict["message"]
-    qgraph = message["query_graph"]
-    message["auxiliary_graphs"] = message.get("auxiliary_graphs") or {}
-    workflow = request_dict.get("workflow", [])
-    if not workflow:
+    if not request_dict.get("workflow"):
         raise HTTPException(400, "Request must include a workflow.")
+    check_timeout(request_dict)
+    logger = request_logger(request_dict)
+    await admit(logger)
+    if request_dict.pop("stream", False) or NDJSON in raw_request.headers.get("accept", ""):
+        # The stream holds its slot until it ends or the client disconnects
+        return StreamingResponse(
+            stream_workflow(request_dict, logger, request_dict.pop("stream_messages", False)),
+            media_type=NDJSON,
+        )
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(wait_for_disconnect(raw_request, disconnected))
+    try:
+        response = await execute_workflow(request_dict, logger, disconnected)
+    finally:
+        watcher.cancel()
+        await ADMISSION.release()
+    return FastJSONResponse(response)
+
+
+def check_timeout(request_dict: dict):
+    """Reject a query whose "timeout" is not a positive number of seconds."""
+    timeout = request_dict.get("timeout", WORKFLOW_TIMEOUT)
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not timeout > 0:
+        raise HTTPException(400, "\"timeout\" must be a positive number of seconds.")
+
+
+async def admit(logger: logging.Logger):
+    """Wait for the admission queue, or reject the query if it is full."""
+    try:
+        with STAGE_DURATION.time(stage="admission"):
+            waited = await ADMISSION.acquire()
+    except asyncio.QueueFull:
+        raise HTTPException(
+            503,
+            "Too many queries, try again later.",
+            headers={"Retry-After": str(QUERY_RETRY_AFTER)},
+        )
+    if waited:
+        logger.info("Waited %.3f seconds for other queries to finish", waited)
+
+
+async def wait_for_disconnect(request: Request, disconnected: asyncio.Event):
+    """Set disconnected when the client goes away.
+
+    The request body has been read, so the next ASGI message is the disconnect.
+    """
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+    disconnected.set()
+
+
+async def stream_workflow(
+        request_dict: dict,
+        logger: logging.Logger,
+        include_messages: bool = False,
+) -> AsyncIterator[str]:
+    """Serialize workflow events as newline-delimited JSON.
+
+    The admission slot of the query is given back when the stream ends,
+    however it ends.
+    """
+    try:
+        async for event in workflow_events(request_dict, logger):
+            if not include_messages:
+                event = {key: value for key, value in event.items() if key != "message"}
+            yield dumps(event) + b"\n"
+    finally:
+        await ADMISSION.release()
+
+
+def request_logger(request_dict: dict) -> logging.Logger:
+    """Generate a logger for a query, at the query's log level."""
     logger = gen_logger()
     log_level = request_dict.get("log_level", "ERROR")
     logger.setLevel(logging._nameToLevel[log_level])
+    return logger
+
+
+async def execute_workflow(
+        request_dict: dict,
+        logger: logging.Logger,
+        disconnected: Optional[asyncio.Event] = None,
+) -> dict:
+    """Run the operations of a workflow one after another.
+
+    The TRAPI response is returned as a dict, built from messages that were
+    already validated on the way in, so it is not validated again.
+    """
+    async for event in workflow_events(request_dict, logger, disconnected):
+        if event["event"] == "response":
+            return event["response"]
+
+
+async def workflow_events(
+        request_dict: dict,
+        logger: logging.Logger,
+        disconnected: Optional[asyncio.Event] = None,
+) -> AsyncIterator[dict]:
+    """Run the operations of a workflow one after another.
+
+    Yields an "operation" event as each operation completes, and finally a
+    "response" event holding the workflow's Response. If the workflow's
+    deadline passes or disconnected is set first, the operation in progress
+    is cancelled and the response holds the message as of the last
+    completed operation.
+    """
+    WORKFLOWS_IN_PROGRESS.inc()
+    try:
+        async for event in _workflow_events(request_dict, logger, disconnected):
+            yield event
+    finally:
+        WORKFLOWS_IN_PROGRESS.dec()
+
+
+async def _workflow_events(
+        request_dict: dict,
+        logger: logging.Logger,
+        disconnected: Optional[asyncio.Event],
+) -> AsyncIterator[dict]:
+    deadline = time.monotonic() + request_dict.pop("timeout", WORKFLOW_TIMEOUT)
+    message = request_dict["message"]
+    message["auxiliary_graphs"] = message.get("auxiliary_graphs") or {}
+    workflow = request_dict["workflow"]
     completed_workflow = []
+    plan = ROUTING.plan(workflow)
 
-    for operation in workflow:
-        operation_services = []
-        runner_parameters = operation.pop("runner_parameters", {})
-        operation_timeout = runner_parameters.get("timeout", 60.0)
-        async with httpx.AsyncClient(verify=False, timeout=operation_timeout) as client:
-            if "allowlist" in runner_parameters.keys():
-                for service in SERVICES.get(operation["id"], []):
-                    if service["infores"] in runner_parameters["allowlist"]:
-                        operation_services.append(service)
+    async with client_session() as client:
+        for index, (operation, operation_services) in enumerate(zip(workflow, plan)):
+            runner_parameters = operation.pop("runner_parameters", {})
+            # Split what is left of the workflow's time between the
+            # remaining operations, time an operation does not use is
+            # left to the ones after it
+            remaining = deadline - time.monotonic()
+            if "timeout" in runner_parameters:
+                operation_timeout = min(runner_parameters["timeout"], remaining)
             else:
-                for service in SERVICES.get(operation["id"], []):
-                    operation_services.append(service)
-                if "denylist" in runner_parameters.keys():
-                    for service in operation_services:
-                        if service["infores"] in runner_parameters["denylist"]:
-                            operation_services.remove(service)
-
-            if operation_services:
-                logger.debug(f"Service providers to query for operation '{operation}':'{operation_services}'")
-            else:
-                logger.error(f"Unable to complete workflow: No service providers for operation '{operation}'")
-                return Response(
-                    message=message,
-                    workflow=completed_workflow,
-                    logs=logger.handlers[0].store,
-                )
+                operation_timeout = min(OPERATION_TIMEOUT, remaining / (len(workflow) - index))
+            use_cache = not (request_dict.get("bypass_cache") or runner_parameters.get("bypass_cache"))
+
+            operation_start = time.monotonic()
+            service_reports = []
+            local_message = None
+            if runner_parameters.get("local", LOCAL_OPERATIONS):
+                local_message = run_local_operation(operation, message, OPERATIONS, logger)
 
-            service_operation_responses = []
-
-            for service in operation_services:
-                url = service["url"]
-                service_name = service["title"]
-                logger.debug(f"Requesting operation '{operation}' from {service_name}...")
-                try:
-                    response = await post_safely(
-                        url,
-                        {
-                            "message": message,
-                            "workflow": [
-                                operation,
-                            ],
-                            "submitter": "Workflow Runner",
-                        },
-                        client=client,
-                        timeout=operation_timeout,
-                        logger=logger,
-                        service_name=service_name,
-                    )
-                    logger.debug(f"Received operation '{operation}' from {service_name}...")
-
-                    try:
-                        response = await post_safely(
-                            NORMALIZER_URL + "/query",
-                            {
-                                "message": response["message"],
-                                "submitter": "Workflow Runner"
-                            },
-                            client=client,
-                            timeout=60.0,
-                            logger=logger,
-                            service_name="node_normalizer"
-                        )
-                    except RuntimeError as e:
-                        logger.warning({
-                            "error": str(e)
-                        })
-
-                    service_operation_responses.append(response)
-                
-                except RuntimeError as e:
+            if local_message is not None:
+                message = local_message
+                service_reports.append({
+                    "title": APP.title,
+                    "infores": APP.infores,
+                    "status": "local",
+                    "duration": round(time.monotonic() - operation_start, 3),
+                })
+            elif operation_services:
+                logger.debug("Service providers to query for operation '%s':'%s'", operation, operation_services)
+                operation_task = asyncio.create_task(run_remote_operation(
+                    client,
+                    operation,
+                    operation_services,
+                    message,
+                    operation_timeout,
+                    deadline,
+                    logger,
+                    use_cache,
+                    service_reports,
+                ))
+                reason = await wait_for_operation(operation_task, deadline, disconnected)
+                if reason is not None:
+                    operation["runner_parameters"] = runner_parameters
                     logger.warning({
-                        "error": str(e)
+                        "message": f"Workflow stopped during operation '{operation['id']}' because {reason}, "
+                                   "returning the message as of the last completed operation",
+                        "services": service_reports,
                     })
+                    yield response_event(message, completed_workflow, logger)
+                    return
+                message = operation_task.result()
+            else:
+                logger.error(f"Unable to complete workflow: No service providers for operation '{operation}'")
+                yield response_event(message, completed_workflow, logger)
+                return
 
-                if not OPERATIONS[operation["id"]]["unique"] and len(service_operation_responses) == 1:
-                    # We only need one successful response for non-unique operations
-                    break
-            
-            logger.debug(f"Merging {len(service_operation_responses)} responses for '{operation}'...")
-            m = Message(query_graph=QueryGraph.parse_obj(qgraph))
-            for response in service_operation_responses:
-                response["message"]["query_graph"] = qgraph
-                m.update(Message.parse_obj(response["message"]))
-            message = m.dict()
+            compacted_bytes = 0
+            if runner_parameters.get("compact", COMPACT_MESSAGES):
+                with STAGE_DURATION.time(stage="compact"):
+                    message, compacted_bytes = compact_message(message)
+                logger.debug("Compacting the message after '%s' saved %d bytes", operation["id"], compacted_bytes)
 
             operation["runner_parameters"] = runner_parameters
 
             completed_workflow.append(operation)
-        
-    return Response(
-        message=message,
-        workflow=workflow,
-        logs=logger.handlers[0].store,
+            kgraph = message["knowledge_graph"] or {}
+            yield {
+                "event": "operation",
+                "operation": operation,
+                "services": service_reports,
+                "duration": round(time.monotonic() - operation_start, 3),
+                "results": len(message["results"] or []),
+                "nodes": len(kgraph.get("nodes") or {}),
+                "edges": len(kgraph.get("edges") or {}),
+                "compacted_bytes": compacted_bytes,
+                "message": message,
+            }
+
+    yield response_event(message, workflow, logger)
+
+
+def response_event(message: dict, workflow: list[dict], logger: logging.Logger) -> dict:
+    """Build the final event of a workflow."""
+    return {
+        "event": "response",
+        "response": {
+            "message": message,
+            "workflow": workflow,
+            "logs": logger.handlers[0].store,
+        },
+    }
+
+
+async def wait_for_operation(
+        task: asyncio.Task,
+        deadline: float,
+        disconnected: Optional[asyncio.Event],
+) -> Optional[str]:
+    """Wait for an operation, cancelling it if the deadline passes or the client disconnects first.
+
+    Returns why the operation was cancelled, or None if it completed.
+    """
+    waiters = {task}
+    if disconnected is not None:
+        disconnect = asyncio.create_task(disconnected.wait())
+        waiters.add(disconnect)
+    try:
+        await asyncio.wait(
+            waiters,
+            timeout=max(0.0, deadline - time.monotonic()),
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+    finally:
+        if disconnected is not None:
+            disconnect.cancel()
+        # Also when the workflow itself is cancelled, e.g. a stream is closed
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    if not task.cancelled():
+        return None
+    if disconnected is not None and disconnected.is_set():
+        return "the client disconnected"
+    return "the workflow deadline passed"
+
+
+async def run_remote_operation(
+        client: httpx.AsyncClient,
+        operation: dict,
+        operation_services: list[dict],
+        message: dict,
+        operation_timeout: float,
+        deadline: float,
+        logger: logging.Logger,
+        use_cache: bool,
+        service_reports: list[dict],
+) -> dict:
+    """Run an operation on its service providers and merge their responses.
+
+    Providers get operation_timeout seconds each, and nothing runs past
+    the workflow's deadline. A report of each provider's part is added to
+    service_reports.
+    """
+    qgraph = message["query_graph"]
+    operation_services, skipped_services = HEALTH.select(operation_services)
+    forced = not operation_services
+    if forced:
+        # Every provider is failing, try them all rather than none
+        operation_services, skipped_services = skipped_services, []
+    for service in skipped_services:
+        logger.debug("Skipping %s for operation '%s', its circuit is open", service["title"], operation["id"])
+        service_reports.append({**service_report(service), "status": "skipped"})
+
+    if OPERATIONS[operation["id"]]["unique"]:
+        # Unique operations need every provider, so query them all at once
+        for service in operation_services:
+            # Claim the trials of half-open circuits, nothing ran since select
+            HEALTH.allow(service["url"])
+        service_operation_responses = await scatter_gather(
+            client,
+            operation_services,
+            message,
+            operation,
+            operation_timeout,
+            logger,
+            use_cache,
+            service_reports,
+        )
+        service_messages = await prepare_messages(
+            client,
+            service_operation_responses,
+            qgraph,
+            UPSTREAM_VALIDATION,
+            logger,
+            deadline,
+        )
+    else:
+        service_messages = []
+        # Try the fastest healthy providers first
+        for service in HEALTH.order(operation_services):
+            timeout = min(operation_timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                logger.warning({
+                    "error": f"No time left to try {service['title']} for operation '{operation['id']}'",
+                })
+                break
+            if not HEALTH.allow(service["url"]) and not forced:
+                # Another query took the trial of its half-open circuit meanwhile
+                logger.debug("Skipping %s for operation '%s', its circuit is open", service["title"], operation["id"])
+                service_reports.append({**service_report(service), "status": "skipped"})
+                continue
+            service_reports.append(service_report(service))
+            try:
+                response = await query_service(
+                    client,
+                    service,
+                    message,
+                    operation,
+                    timeout,
+                    logger,
+                    use_cache,
+                    service_reports[-1],
+                )
+            except RuntimeError as e:
+                logger.warning({
+                    "error": str(e)
+                })
+                continue
+            service_messages = await prepare_messages(
+                client,
+                [(service, response)],
+                qgraph,
+                UPSTREAM_VALIDATION,
+                logger,
+                deadline,
+            )
+            if service_messages:
+                # We only need one successful response for non-unique operations
+                break
+
+    logger.debug("Merging %d responses for '%s'...", len(service_messages), operation)
+    with STAGE_DURATION.time(stage="merge"):
+        return merge_messages(qgraph, service_messages)
+
+
+def service_report(service: dict) -> dict:
+    """Start a report of a service's part in an operation."""
+    return {
+        "title": service["title"],
+        "infores": service["infores"],
+        "status": "pending",
+    }
+
+
+async def query_service(
+        client: httpx.AsyncClient,
+        service: dict,
+        message: dict,
+        operation: dict,
+        timeout: float,
+        logger: logging.Logger,
+        use_cache: bool = False,
+        report: Optional[dict] = None,
+) -> dict:
+    """Request an operation from a service provider.
+
+    If given, report is updated with the status and duration of the request.
+    """
+    if report is None:
+        report = service_report(service)
+    timing = RequestTiming()
+    start = time.monotonic()
+    try:
+        response = await _query_service(
+            client, service, message, operation, timeout, logger, use_cache, report, timing,
+        )
+    except RuntimeError:
+        report["status"] = "failed"
+        raise
+    except asyncio.CancelledError:
+        # scatter_gather marks the services it gives up on as timed out,
+        # anything else was cancelled with the workflow
+        if report["status"] == "pending":
+            report["status"] = "cancelled"
+        raise
+    finally:
+        duration = time.monotonic() - start
+        report["duration"] = round(duration, 3)
+        if report["status"] in ("cancelled", "cached") or timing.sent is None:
+            # Not the service's fault, or it was never sent the request,
+            # e.g. timed out waiting for a slot, give back a claimed
+            # circuit breaker trial
+            HEALTH.release(service["url"])
+        else:
+            # Time spent waiting for a slot to the service is not its own
+            HEALTH.record(
+                service["url"],
+                report["status"] == "success",
+                time.monotonic() - max(start, timing.sent),
+            )
+    return response
+
+
+async def _query_service(
+        client: httpx.AsyncClient,
+        service: dict,
+        message: dict,
+        operation: dict,
+        timeout: float,
+        logger: logging.Logger,
+        use_cache: bool,
+        report: dict,
+        timing: RequestTiming,
+) -> dict:
+    url = service["url"]
+    service_name = service["title"]
+    key = None
+    if RESPONSE_CACHE is not None and use_cache:
+        key = cache_key(message, operation, url)
+        response = await RESPONSE_CACHE.get(key)
+        if response is not None:
+            logger.debug("Using cached operation '%s' from %s", operation, service_name)
+            report["status"] = "cached"
+            return response
+    logger.debug("Requesting operation '%s' from %s...", operation, service_name)
+    response = await post_safely(
+        url,
+        {
+            "message": message,
+            "workflow": [
+                operation,
+            ],
+            "submitter": "Workflow Runner",
+        },
+        client=client,
+        timing=timing,
+        timeout=timeout,
+        logger=logger,
+        service_name=service_name,
+        # Responses are validated after normalization, in prepare_messages
+        validation="structural",
+    )
+    logger.debug("Received operation '%s' from %s...", operation, service_name)
+    report["status"] = "success"
+    if key is not None:
+        await RESPONSE_CACHE.set(key, response, operation["id"])
+    return response
+
+
+async def prepare_messages(
+        client: httpx.AsyncClient,
+        service_responses: list[tuple[dict, dict]],
+        qgraph: dict,
+        validation: str,
+        logger: logging.Logger,
+        deadline: Optional[float] = None,
+) -> list[dict]:
+    """Normalize and validate service responses for merging.
+
+    All responses are normalized with one lookup over their union. Depending
+    on the validation mode, each normalized message is validated against
+    TRAPI; non-compliant ones are dropped.
+    """
+    with STAGE_DURATION.time(stage="normalize"):
+        service_messages = await NORMALIZER.normalize_messages(
+            [response["message"] for _, response in service_responses],
+            client=client,
+            timeout=60.0 if deadline is None else max(0.0, min(60.0, deadline - time.monotonic())),
+            logger=logger,
+        )
+    valid_messages = []
+    for (service, _), service_message in zip(service_responses, service_messages):
+        service_message["query_graph"] = qgraph
+        if should_validate(validation):
+            try:
+                with STAGE_DURATION.time(stage="validate"):
+                    parse_message(service_message)
+            except ValidationError as e:
+                logger.warning({
+                    "message": f"Received non-TRAPI compliant response from {service['title']}",
+                    "error": str(e),
+                })
+                continue
+        valid_messages.append(service_message)
+    return valid_messages
+
+
+async def scatter_gather(
+        client: httpx.AsyncClient,
+        services: list[dict],
+        message: dict,
+        operation: dict,
+        timeout: float,
+        logger: logging.Logger,
+        use_cache: bool = False,
+        reports: Optional[list[dict]] = None,
+) -> list[tuple[dict, dict]]:
+    """Query all service providers concurrently.
+
+    Each provider runs under its own deadline. Whatever finishes within the
+    operation timeout is kept as (service, response) pairs, in service order;
+    the rest is cancelled. A report of each service is added to reports.
+    """
+    service_reports = [service_report(service) for service in services]
+    if reports is not None:
+        reports.extend(service_reports)
+    tasks = [
+        asyncio.create_task(query_service(
+            client,
+            service,
+            message,
+            operation,
+            timeout,
+            logger,
+            use_cache,
+            report,
+        ))
+        for service, report in zip(services, service_reports)
+    ]
+    try:
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    for task, report in zip(tasks, service_reports):
+        if task in pending:
+            report["status"] = "timeout"
+            task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    responses = []
+    for service, task in zip(services, tasks):
+        if task in pending:
+            logger.warning({
+                "error": f"{service['title']} did not finish operation '{operation['id']}' within {round(timeout, 3)} seconds",
+            })
+            continue
+        try:
+            responses.append((service, task.result()))
+        except RuntimeError as e:
+            logger.warning({
+                "error": str(e)
+            })
+    return responses
+
+
+@APP.post(
+        "/asyncquery",
+        tags=["trapi"],
+        response_model=AsyncQueryResponse,
+)
+async def run_workflow_async(
+        request: AsyncQuery = Body(..., example={
+            **load_example("query"),
+            "callback": "http://localhost:8000/callback",
+        }),
+) -> AsyncQueryResponse:
+    """Queue a workflow, the response is sent to the callback url."""
+    request_dict = request.dict(
+        exclude_unset=True,
+    )
+    if not request_dict.get("workflow"):
+        raise HTTPException(400, "Request must include a workflow.")
+    check_timeout(request_dict)
+    logger = request_logger(request_dict)
+    try:
+        job = JOBS.submit(request_dict, logger)
+    except asyncio.QueueFull:
+        raise HTTPException(503, "Too many queued queries, try again later.")
+    return AsyncQueryResponse(
+        status="Accepted",
+        description="Query has been queued.",
+        job_id=job.id,
+    )
+
+
+@APP.get(
+        "/asyncquery_status/{job_id}",
+        tags=["trapi"],
+        response_model=AsyncQueryStatusResponse,
+)
+async def get_async_status(job_id: str, request: Request) -> AsyncQueryStatusResponse:
+    """Get the status of a queued workflow."""
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"Job {job_id} not found.")
+    response_url = None
+    if job.response is not None:
+        response_url = request.url_for("get_async_response", job_id=job_id)
+    return AsyncQueryStatusResponse(
+        status=job.status,
+        description=job.description,
+        logs=job.logs,
+        response_url=response_url,
     )
 
 
+@APP.get(
+        "/asyncquery_response/{job_id}",
+        tags=["trapi"],
+        response_model=Response,
+        response_model_exclude_unset=True,
+)
+async def get_async_response(job_id: str) -> Response:
+    """Get the response of a completed workflow."""
+    job = JOBS.get(job_id)
+    if job is None or job.response is None:
+        raise HTTPException(404, f"No response for job {job_id}.")
+    return FastJSONResponse(job.response)
+
+
+@APP.get(
+    "/metrics",
+    include_in_schema=False,
+    response_class=PlainTextResponse,
+)
+async def get_metrics() -> PlainTextResponse:
+    """Get metrics in the Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 @APP.get(
     "/services",
     response_model=Services,
 )
 async def get_services() -> Services:
-    """Get registered services."""
-    return SERVICES
+    """Get registered services, with the current health of each."""
+    return {
+        operation_id: [
+            {**service, "health": HEALTH.score(service["url"])}
+            for service in services
+        ]
+        for operation_id, services in SERVICES.items()
+    }
 
 @APP.get(
     "/operations",
@@ -215,60 +847,117 @@ async def get_operations() -> Operations:
     return OPERATIONS
 
 @APP.on_event("startup")
-@APP.post("/refresh")
-async def refresh_services_and_operations():
-    """Fetch available services from smartapi and operations from standards.ncats.io"""
-    global SERVICES
-    # Start with empty SERVICES dict.
-    SERVICES = defaultdict(list)
-    endpoints = SmartAPI(OPENAPI_SERVER_MATURITY, TRAPI_VERSION, LOGGER).get_operations_endpoints()
-    for endpoint in endpoints:
-        try:
-            base_url = parse_obj_as(HttpUrl, endpoint["url"])
-        except ValidationError as err:
-            # It may contain a relative path
-            # This is aloud by smart-api
-            # And is relative to the source_url for the open-api doc
-            # https://spec.openapis.org/oas/latest.html#server-object
-            #
-            # The url can also reference variables in {brackets}
-            # This is not yet supported here
+async def load_registry():
+    """Start from the registry snapshot, if there is one, and refresh it in the background.
+
+    Workers sharing a snapshot start from the one the gunicorn master
+    resolved, and load the snapshots other workers save.
+    """
+    global SNAPSHOT_VERSION
+    shared = REGISTRY_SHARED and bool(REGISTRY_SNAPSHOT_PATH)
+    if REGISTRY_SHARED and not shared:
+        LOGGER.warning("REGISTRY_SNAPSHOT_PATH is empty, every worker resolves its own services and operations")
+    version = snapshot_version(REGISTRY_SNAPSHOT_PATH)
+    snapshot = load_snapshot(REGISTRY_SNAPSHOT_PATH, REGISTRY_CONFIG)
+    if snapshot is None:
+        await refresh_services_and_operations()
+    else:
+        LOGGER.info("Loaded services and operations from %s", REGISTRY_SNAPSHOT_PATH)
+        apply_snapshot(snapshot)
+        SNAPSHOT_VERSION = version
+    REGISTRY_TASKS.append(asyncio.create_task(refresh_periodically(
+        refresh_now=snapshot is not None and not shared,
+        shared=shared,
+    )))
+    if shared:
+        REGISTRY_TASKS.append(asyncio.create_task(watch_snapshot()))
+
+
+@APP.on_event("shutdown")
+async def stop_refresh():
+    """Stop refreshing the registry."""
+    for task in REGISTRY_TASKS:
+        task.cancel()
+    await asyncio.gather(*REGISTRY_TASKS, return_exceptions=True)
+    REGISTRY_TASKS.clear()
+
+
+async def refresh_periodically(refresh_now: bool, shared: bool = False):
+    """Refresh the registry every REGISTRY_REFRESH_INTERVAL seconds.
+
+    Only one of the workers sharing a snapshot refreshes it.
+    """
+    while True:
+        if refresh_now and (not shared or acquire_refresh_lock(REGISTRY_SNAPSHOT_PATH)):
             try:
-                source_url_stem = endpoint["source_url"][:endpoint["source_url"].rfind("/")]
-                full_url = source_url_stem + endpoint["url"]
-                base_url = parse_obj_as(HttpUrl, full_url)
-            except ValidationError as err:
-                LOGGER.warning("Invalid URL '%s' '%s': %s", endpoint["source_url"], endpoint["url"], err)
-                continue
-        # Now actualy check if we can contact the endpoint
-        try:
-            response = httpx.get(base_url + "/query", follow_redirects=True)
-        except (httpx.ReadTimeout, httpx.ConnectError, httpx.ConnectTimeout):
-            LOGGER.warning("Discarding '%s due to timeout.", base_url)
+                await refresh_services_and_operations()
+            except Exception:
+                LOGGER.exception("Failed to refresh services and operations, keeping the current ones")
+        if REGISTRY_REFRESH_INTERVAL <= 0:
+            return
+        await asyncio.sleep(REGISTRY_REFRESH_INTERVAL)
+        refresh_now = True
+
+
+async def watch_snapshot():
+    """Serve the snapshots other workers save, on refresh or POST /refresh."""
+    global SNAPSHOT_VERSION
+    while True:
+        await asyncio.sleep(REGISTRY_WATCH_INTERVAL)
+        version = snapshot_version(REGISTRY_SNAPSHOT_PATH)
+        if version is None or version == SNAPSHOT_VERSION:
             continue
-        if response.status_code == 404:
-            # Not a valid URL
-            try:
-                response = httpx.post(base_url + "/query")
-            except (httpx.ReadTimeout, httpx.ConnectError, httpx.ConnectTimeout):
-                LOGGER.warning("Discarding '%s due to timeout after 404.", base_url)
-                continue
-            if response.status_code == 404:
-                LOGGER.warning("404 recieved for '%s'", base_url)
-                continue
-        # More than likely this is a 405 or some other error
-        # Any response at this point is good
+        snapshot = await asyncio.to_thread(load_snapshot, REGISTRY_SNAPSHOT_PATH, REGISTRY_CONFIG)
+        SNAPSHOT_VERSION = version
+        if snapshot is not None:
+            LOGGER.info("Loaded services and operations saved by another worker")
+            apply_snapshot(snapshot)
+
+
+def refresh_shared_registry():
+    """Resolve services and operations once, for all workers.
+
+    Run by the gunicorn master before it starts its workers.
+    """
+    previous = load_snapshot(REGISTRY_SNAPSHOT_PATH, REGISTRY_CONFIG)
+    try:
+        snapshot = asyncio.run(refresh_registry(
+            SmartAPI(OPENAPI_SERVER_MATURITY, TRAPI_VERSION, LOGGER),
+            StandardOperations(),
+            REGISTRY_CONFIG,
+            previous,
+            LOGGER,
+        ))
+    except Exception:
+        LOGGER.exception("Failed to resolve services and operations, workers will try on startup")
+        return
+    save_snapshot(REGISTRY_SNAPSHOT_PATH, snapshot)
+
 
-        endpoint["url"] = base_url + "/query"
+def apply_snapshot(snapshot: dict):
+    """Serve the services and operations of a registry snapshot."""
+    global SERVICES, OPERATIONS, ROUTING, REGISTRY_SNAPSHOT
+    # Swap in the new tables at once,
+    # in-flight queries keep using the old ones.
+    REGISTRY_SNAPSHOT = snapshot
+    SERVICES, OPERATIONS = snapshot["services"], snapshot["operations"]
+    ROUTING = RoutingTable(SERVICES)
+    APP.set_operation_ids(list(OPERATIONS))
 
-        # Popped for cleanliness in /services enpoint
-        operations = endpoint.pop("operations")
-        for operation in operations:
-            SERVICES[operation].append(endpoint)
-    SERVICES = dict(SERVICES)
 
-    # Update Operations
-    global OPERATIONS
-    OPERATIONS = StandardOperations().get_operations()
+@APP.post("/refresh")
+async def refresh_services_and_operations():
+    """Fetch available services from smartapi and operations from standards.ncats.io"""
+    global SNAPSHOT_VERSION
+    snapshot = await refresh_registry(
+        SmartAPI(OPENAPI_SERVER_MATURITY, TRAPI_VERSION, LOGGER),
+        StandardOperations(),
+        REGISTRY_CONFIG,
+        REGISTRY_SNAPSHOT,
+        LOGGER,
+    )
+    apply_snapshot(snapshot)
+    await asyncio.to_thread(save_snapshot, REGISTRY_SNAPSHOT_PATH, snapshot)
+    SNAPSHOT_VERSION = snapshot_version(REGISTRY_SNAPSHOT_PATH)
 
     return "Workflow services and operations refreshed successfully."
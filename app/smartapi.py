@@ -5,23 +5,33 @@ import os
 import re
 import httpx
 
+SMARTAPI_URL = os.getenv("SMARTAPI_URL", "http://smart-api.info/api")
+
 
 class SmartAPI:
     """SmartAPI."""
 
     def __init__(self, maturity, trapi, logger):
         """Initialize."""
-        self.base_url = "http://smart-api.info/api"
+        self.base_url = SMARTAPI_URL
         # get workflow-runner maturity level
         self.maturity = maturity
         self.trapi = trapi
         self.logger = logger
 
+    @property
+    def query_url(self):
+        """URL of the registry query for TRAPI endpoints."""
+        return self.base_url + "/query?limit=1000&q=TRAPI"
+
     @cache
     def get_operations_endpoints(self):
         """Find all endpoints that support at least one workflow operation."""
-        endpoints = self.get_trapi_endpoints()
+        return self.filter_operations_endpoints(self.get_trapi_endpoints())
 
+    @staticmethod
+    def filter_operations_endpoints(endpoints):
+        """Keep the endpoints that support at least one workflow operation."""
         operations_endpoints = []
         for endpoint in endpoints:
             if endpoint["operations"] is not None:
@@ -33,13 +43,15 @@ class SmartAPI:
     def get_trapi_endpoints(self):
         """Find all endpoints that match a query for TRAPI."""
         response_content = httpx.get(
-            self.base_url + "/query?limit=1000&q=TRAPI",
+            self.query_url,
             headers={"accept": "application/json"},
         )
 
         response_content.raise_for_status()
-        response_dict = response_content.json()
+        return self.parse_trapi_endpoints(response_content.json())
 
+    def parse_trapi_endpoints(self, response_dict):
+        """Find the TRAPI endpoints in a registry query response."""
         endpoints = []
         for hit in response_dict["hits"]:
             try:
@@ -1,14 +1,17 @@
 """Translator Standards Operations registry access utility."""
 from functools import cache
+import os
 
 import httpx
 
+OPERATIONS_SCHEMA_URL = os.getenv("OPERATIONS_SCHEMA_URL", "https://standards.ncats.io/operation/1.3.2/schema")
+
 class StandardOperations:
     """StandardOperations."""
 
     def __init__(self):
         """Initialize."""
-        self.base_url = "https://standards.ncats.io/operation/1.3.2/schema"
+        self.base_url = OPERATIONS_SCHEMA_URL
 
     @cache
     def get_operations(self):
@@ -19,8 +22,11 @@ class StandardOperations:
         )
 
         response_content.raise_for_status()
-        response_dict = response_content.json()
+        return self.parse_operations(response_content.json())
 
+    @staticmethod
+    def parse_operations(response_dict):
+        """Find the operations in an operations schema."""
         operations = {}
         for op, props in response_dict["$defs"].items():
             
@@ -37,6 +43,7 @@ class StandardOperations:
                 "title": op,
                 "description": props.get('description',''),
                 "properties": properties,
+                "required": props.get('required', []),
                 "additionalProperties": props.get('additionalProperties',False),
                 "unique": unique
             }
@@ -33,6 +33,14 @@ class TRAPI(FastAPI):
         self.translator_teams = translator_teams
         self.infores = infores
         self.trapi = trapi
+        # Operation ids for the schema, fetched from the standards when unset
+        self.operation_ids: Optional[List[str]] = None
+
+    def set_operation_ids(self, operation_ids: List[str]):
+        """Set the operations advertised in the schema."""
+        if operation_ids != self.operation_ids:
+            self.operation_ids = operation_ids
+            self.openapi_schema = None
 
     def openapi(self) -> Dict[str, Any]:
         """Build custom OpenAPI schema."""
@@ -63,7 +71,9 @@ class TRAPI(FastAPI):
             },
             "infores": self.infores,
         }
-        all_operations = StandardOperations().get_all_operations()
+        all_operations = self.operation_ids
+        if all_operations is None:
+            all_operations = StandardOperations().get_all_operations()
         openapi_schema["info"]["x-trapi"] = {
             "version": self.trapi,
             "externalDocs": {
@@ -1,9 +1,11 @@
 """Utilities."""
 import asyncio
-import copy
+import hashlib
 import json
 import logging
+import os
 from pathlib import Path
+import time
 import traceback
 from typing import Any, Optional
 
@@ -11,115 +13,327 @@ import httpx
 import pydantic
 from reasoner_pydantic import Response
 
+from .compression import ResponseTooLarge, fetch_json
+from .diagnostics import DEBUG_CAPTURE_DIR, capture, preview, summarize_payload
+from .http_client import client_session
+from .metrics import (
+    STAGE_DURATION,
+    UPSTREAM_COALESCED,
+    UPSTREAM_DURATION,
+    UPSTREAM_REQUESTS,
+    UPSTREAM_RESPONSE_SIZE,
+)
+from .serialization import dumps
+from .validation import UPSTREAM_VALIDATION, TRAPIStructureError, check_structure, should_validate
+
 EXAMPLES_DIR = Path(__file__).parent / "openapi_examples"
 
+# Concurrent requests to each upstream URL, 0 for no limit
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", 16))
+# Per-URL overrides, e.g. '{"https://nodenormalization-sri.renci.org/get_normalized_nodes": 32}'
+UPSTREAM_CONCURRENCY_LIMITS = json.loads(os.getenv("UPSTREAM_CONCURRENCY_LIMITS", "{}"))
+
+# Bytes of an upstream response read before giving up on it, 0 for no limit
+UPSTREAM_MAX_RESPONSE_BYTES = int(os.getenv("UPSTREAM_MAX_RESPONSE_BYTES", 1024 ** 3))
+# Per-URL and per-operation overrides, the smaller applies if both are set
+UPSTREAM_RESPONSE_BYTES_LIMITS = json.loads(os.getenv("UPSTREAM_RESPONSE_BYTES_LIMITS", "{}"))
+OPERATION_RESPONSE_BYTES_LIMITS = json.loads(os.getenv("OPERATION_RESPONSE_BYTES_LIMITS", "{}"))
+
+# Share one request between identical concurrent ones
+UPSTREAM_COALESCING = os.getenv("UPSTREAM_COALESCING", "true").lower() == "true"
+
+# Created on first use of each URL
+SERVICE_SLOTS: dict[str, asyncio.Semaphore] = {}
+
+# Shared requests in flight, by URL, validation mode and body hash
+IN_FLIGHT: dict[tuple, "SharedRequest"] = {}
+
+
+class RequestTiming:
+    """When an upstream request got a slot and was sent, None until then."""
+
+    def __init__(self):
+        """Initialize."""
+        self.sent: Optional[float] = None
+
+
+class SharedRequest:
+    """An upstream request and the number of callers waiting for it."""
+
+    def __init__(self, task: asyncio.Task, timing: RequestTiming):
+        """Initialize."""
+        self.task = task
+        self.timing = timing
+        self.waiters = 0
+
+
+def service_slots(url: str) -> Optional[asyncio.Semaphore]:
+    """Get the semaphore limiting concurrent requests to a URL, if it is limited."""
+    if url not in SERVICE_SLOTS:
+        limit = UPSTREAM_CONCURRENCY_LIMITS.get(url, UPSTREAM_CONCURRENCY)
+        SERVICE_SLOTS[url] = asyncio.Semaphore(limit) if limit > 0 else None
+    return SERVICE_SLOTS[url]
+
+
+def response_limit(url: str, operation: str) -> Optional[int]:
+    """Get the most bytes of a response from url to an operation that are read, or None."""
+    limits = [
+        limit
+        for limit in (UPSTREAM_RESPONSE_BYTES_LIMITS.get(url), OPERATION_RESPONSE_BYTES_LIMITS.get(operation))
+        if limit is not None
+    ] or [UPSTREAM_MAX_RESPONSE_BYTES]
+    limits = [limit for limit in limits if limit > 0]
+    return min(limits) if limits else None
+
 
 async def post_safely(
     url: str,
     payload: Any,
     client: Optional[httpx.AsyncClient] = None,
+    timing: Optional[RequestTiming] = None,
+    **kwargs,
+):
+    """POST a json payload to url.
+
+    If given, timing is updated with when the request was sent, after
+    waiting for a slot to url.
+
+    Concurrent calls with the same url, validation and payload, in any key
+    order, share one request, made with the options of the first, and get
+    the same response or failure. The request is cancelled once no caller waits for it.
+    Responses may be shared and must not be modified.
+    """
+    body = dumps(payload)
+    if not UPSTREAM_COALESCING:
+        return await _send(url, payload, body, client, timing, **kwargs)
+
+    # Payloads that only differ in key order are the same request
+    digest = hashlib.sha256(dumps(payload, sort_keys=True)).hexdigest()
+    key = (url, kwargs.get("validation", UPSTREAM_VALIDATION), digest)
+    shared = IN_FLIGHT.get(key)
+    logger = kwargs.get("logger") or logging.getLogger(__name__)
+    service = kwargs.get("service_name") or url
+    if shared is None:
+        shared_timing = RequestTiming()
+        shared = IN_FLIGHT[key] = SharedRequest(
+            asyncio.create_task(_send(url, payload, body, client, shared_timing, **kwargs)),
+            shared_timing,
+        )
+        shared.task.add_done_callback(lambda task: _forget(key, shared))
+        joined = False
+    else:
+        logger.debug("Sharing an identical request to %s already in flight", service)
+        UPSTREAM_COALESCED.inc(service=service)
+        joined = True
+    shared.waiters += 1
+    try:
+        return await asyncio.shield(shared.task)
+    except RuntimeError as e:
+        if joined:
+            # The failure was logged to the logs of the first caller
+            logger.warning({
+                "message": f"Shared request to {service} failed",
+                "error": str(e),
+            })
+        raise
+    finally:
+        if timing is not None:
+            timing.sent = shared.timing.sent
+        shared.waiters -= 1
+        if not shared.waiters and not shared.task.done():
+            # Identical requests from now on must not join the cancelled one
+            _forget(key, shared)
+            shared.task.cancel()
+
+
+def _forget(key: tuple, shared: SharedRequest):
+    if IN_FLIGHT.get(key) is shared:
+        del IN_FLIGHT[key]
+
+
+async def _send(
+    url: str,
+    payload: Any,
+    body: bytes,
+    client: Optional[httpx.AsyncClient] = None,
+    timing: Optional[RequestTiming] = None,
     **kwargs,
 ):
-    """POST a json payload to url."""
-    if client is None:
-        async with httpx.AsyncClient() as client:
-            return await _post_safely(client, url, payload, **kwargs)
+    """POST a serialized payload to url.
+
+    Waits for a slot if UPSTREAM_CONCURRENCY requests to url are in flight.
+    """
+    service = kwargs.get("service_name") or url
+    operation = _operation_id(payload)
+    max_bytes = response_limit(url, operation)
+    slots = service_slots(url)
+    if slots is not None:
+        if slots.locked():
+            queued = time.perf_counter()
+            await slots.acquire()
+            waited = time.perf_counter() - queued
+            STAGE_DURATION.observe(waited, stage="upstream_queue")
+            logger = kwargs.get("logger") or logging.getLogger(__name__)
+            logger.debug("Waited %.3f seconds for a free slot to %s", waited, service)
+        else:
+            await slots.acquire()
+    if timing is not None:
+        timing.sent = time.monotonic()
+    outcome = "cancelled"
+    start = time.perf_counter()
+    try:
+        if client is None:
+            async with client_session() as client:
+                response = await _post_safely(client, url, payload, body, max_bytes=max_bytes, **kwargs)
+        else:
+            response = await _post_safely(client, url, payload, body, max_bytes=max_bytes, **kwargs)
+        outcome = "success"
+        return response
+    except RuntimeError:
+        outcome = "error"
+        raise
+    finally:
+        if slots is not None:
+            slots.release()
+        UPSTREAM_REQUESTS.inc(service=service, operation=operation, outcome=outcome)
+        UPSTREAM_DURATION.observe(time.perf_counter() - start, service=service, operation=operation)
 
-    return await _post_safely(client, url, payload, **kwargs)
+
+def _operation_id(payload: Any) -> str:
+    """Get the id of the operation a TRAPI request asks for, if any."""
+    try:
+        operation_id = payload["workflow"][0]["id"]
+    except (KeyError, IndexError, TypeError):
+        return ""
+    # Parsed workflows hold operation ids as enum members
+    return getattr(operation_id, "value", operation_id)
 
 
 async def _post_safely(
     client: httpx.AsyncClient,
     url: str,
     payload: Any,
+    body: bytes,
     timeout: Optional[float] = None,
     logger: Optional[logging.Logger] = None,
     service_name: Optional[str] = None,
+    validation: Optional[str] = UPSTREAM_VALIDATION,
+    max_bytes: Optional[int] = None,
 ):
+    """POST a json payload to url and check the response.
+
+    validation is one of the TRAPI validation modes, or None for
+    non-TRAPI endpoints. Responses larger than max_bytes are not read.
+    """
     if not logger:
         logger = logging.getLogger(__name__)
     if not service_name:
         service_name = url
+    # The response, or its decoded body, to capture if the request fails
+    response = None
     try:
         # use waitfor instead of httpx's timeout because: https://github.com/encode/httpx/issues/1451#issuecomment-907400740
-        response = await client.post(
+        response_json, size = await asyncio.wait_for(
+            fetch_json(
+                client,
                 url,
-                json=payload,
-            )
-        response.raise_for_status()
-        response_json = response.json()
-        Response(**response_json)  # validate against TRAPI
+                body,
+                timeout=httpx.USE_CLIENT_DEFAULT if timeout is None else timeout,
+                max_bytes=max_bytes,
+            ),
+            timeout=timeout,
+        )
+        response = response_json
+        UPSTREAM_RESPONSE_SIZE.observe(size, service=service_name)
+        if validation is not None:
+            if should_validate(validation):
+                Response(**response_json)  # validate against TRAPI
+            else:
+                check_structure(response_json)
         return response_json
     except asyncio.TimeoutError as e:
-        logger.warning({
+        log_entry = {
             "message": f"{service_name} took >{timeout} seconds to respond",
             "error": str(e),
             "request": {
                 "url": url,
-                "data": elide_curies(payload),
+                "data": summarize_payload(payload),
             },
-        })
+        }
     except httpx.RequestError as e:
         # Log error
-        logger.warning({
+        log_entry = {
             "message": f"Error contacting {service_name}",
             "error": str(e),
-            "request": log_request(e.request),
-        })
+            "request": log_request(e.request, payload),
+        }
     except httpx.HTTPStatusError as e:
         # Log error with response
-        logger.warning({
+        response = e.response
+        log_entry = {
             "message": f"Error response from {service_name}",
             "error": str(e),
-            "request": log_request(e.request),
+            "request": log_request(e.request, payload),
             "response": log_response(e.response),
-        })
+        }
+    except ResponseTooLarge as e:
+        log_entry = {
+            "message": f"Response from {service_name} is larger than the {e.max_bytes} bytes allowed, "
+                       "stopped reading it",
+            "error": str(e),
+            "request": {
+                "url": url,
+                "data": summarize_payload(payload),
+            },
+        }
     except json.JSONDecodeError as e:
         # Log error with response
-        logger.warning({
+        log_entry = {
             "message": f"Received bad JSON data from {service_name}",
             "request": {
-                "data": payload,
+                "data": summarize_payload(payload),
             },
             "response": {
-                "data": e.doc
+                "data": preview(e.doc)
             },
             "error": str(e),
-        })
-    except pydantic.ValidationError as e:
-        logger.warning({
+        }
+    except (pydantic.ValidationError, TRAPIStructureError) as e:
+        log_entry = {
             "message": f"Received non-TRAPI compliant response from {service_name}",
-            "error": str(e),
-        })
+            "error": preview(str(e)),
+        }
     except Exception as e:
         traceback.print_exc()
-        logger.warning({
+        log_entry = {
             "message": f"Something went wrong while querying {service_name}",
             "error": str(e),
-        })
+        }
+    if DEBUG_CAPTURE_DIR:
+        log_entry["capture"] = await capture(service_name, payload, response)
+    logger.warning(log_entry)
     raise RuntimeError(f"Failed to get a good response from {service_name}, see the logs")
 
 
-def elide_curies(payload):
-    """Elide CURIES in TRAPI request/response."""
-    payload = copy.deepcopy(payload)
-    if "message" not in payload:
-        return payload
-    for qnode in payload["message"]["query_graph"]["nodes"].values():
-        if (num_curies := len(qnode.get("ids", None) or [])) > 10:
-            qnode["ids"] = f"**{num_curies} CURIEs not shown for brevity**"
-    return payload
-
+def log_request(r, payload: Any = None):
+    """Serialize a httpx.Request object into a dict for logging.
 
-def log_request(r):
-    """Serialize a httpx.Request object into a dict for logging."""
-    data = r.read().decode()
-    # the request body can be cleared out by httpx under some circumstances
-    # let's not crash if that happens
-    try:
-        data = elide_curies(json.loads(data))
-    except Exception:
-        pass
+    The body is summarized from the payload it was built from, if given,
+    and truncated otherwise.
+    """
+    if payload is not None:
+        data = summarize_payload(payload)
+    else:
+        try:
+            data = r.content
+        except httpx.RequestNotRead:
+            # the request body can be cleared out by httpx under some circumstances
+            # let's not crash if that happens
+            data = b""
+        if r.headers.get("content-encoding"):
+            data = f"<{len(data)} bytes, {r.headers['content-encoding']} encoded>"
+        else:
+            data = preview(data)
     return {
         "method" : r.method,
         "url" : str(r.url),
@@ -129,14 +343,19 @@ def log_request(r):
 
 
 def log_response(r):
-    """Serialize a httpx.Response object into a dict for logging."""
+    """Serialize a httpx.Response object into a dict for logging, with a truncated body."""
     return {
         "status_code" : r.status_code,
         "headers" : dict(r.headers),
-        "data" : r.text,
+        "data" : preview(r.content),
     }
 
 
+def canonical_json(obj) -> str:
+    """Serialize to JSON with a stable key order, for hashing and comparison."""
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"))
+
+
 def load_example(name):
     """Load example from JSON file."""
     with open(EXAMPLES_DIR / (name + ".json"), "r") as stream:
@@ -0,0 +1,93 @@
+"""Upstream response validation."""
+import os
+import random
+
+from reasoner_pydantic import Message, QueryGraph, KnowledgeGraph, Results, AuxiliaryGraphs
+
+# full: validate every response against the TRAPI models
+# sampled: validate a fraction of responses, check the structure of the rest
+# structural: only check the structure the runner relies on
+VALIDATION_MODES = ("full", "sampled", "structural")
+UPSTREAM_VALIDATION = os.getenv("UPSTREAM_VALIDATION", "full")
+if UPSTREAM_VALIDATION not in VALIDATION_MODES:
+    raise ValueError(f"Unknown UPSTREAM_VALIDATION '{UPSTREAM_VALIDATION}', expected one of {VALIDATION_MODES}")
+UPSTREAM_VALIDATION_SAMPLE_RATE = float(os.getenv("UPSTREAM_VALIDATION_SAMPLE_RATE", 0.1))
+
+
+class TRAPIStructureError(ValueError):
+    """Response does not have the shape of a TRAPI response."""
+
+
+def should_validate(mode: str, sample_rate: float = UPSTREAM_VALIDATION_SAMPLE_RATE) -> bool:
+    """Decide whether a response gets full TRAPI validation."""
+    if mode == "full":
+        return True
+    if mode == "sampled":
+        return random.random() < sample_rate
+    if mode == "structural":
+        return False
+    raise ValueError(f"Unknown validation mode '{mode}', expected one of {VALIDATION_MODES}")
+
+
+def _expect(value, kind, path):
+    if not isinstance(value, kind):
+        raise TRAPIStructureError(f"Expected {path} to be {kind.__name__}, got {type(value).__name__}")
+
+
+def check_structure(response: dict):
+    """Check the parts of a TRAPI response the runner relies on, without pydantic."""
+    _expect(response, dict, "response")
+    message = response.get("message")
+    _expect(message, dict, "message")
+
+    kgraph = message.get("knowledge_graph")
+    if kgraph is not None:
+        _expect(kgraph, dict, "message.knowledge_graph")
+        _expect(kgraph.get("nodes"), dict, "message.knowledge_graph.nodes")
+        _expect(kgraph.get("edges"), dict, "message.knowledge_graph.edges")
+        for node_id, node in kgraph["nodes"].items():
+            _expect(node, dict, f"node {node_id}")
+        for edge_id, edge in kgraph["edges"].items():
+            _expect(edge, dict, f"edge {edge_id}")
+            for key in ("subject", "object", "predicate"):
+                _expect(edge.get(key), str, f"edge {edge_id} {key}")
+
+    results = message.get("results")
+    if results is not None:
+        _expect(results, list, "message.results")
+        for index, result in enumerate(results):
+            _expect(result, dict, f"result {index}")
+            _expect(result.get("node_bindings"), dict, f"result {index} node_bindings")
+            for qnode_id, bindings in result["node_bindings"].items():
+                _expect(bindings, list, f"result {index} node_bindings {qnode_id}")
+                for binding in bindings:
+                    _expect(binding, dict, f"result {index} node binding")
+                    _expect(binding.get("id"), str, f"result {index} node binding id")
+            _expect(result.get("analyses", []), list, f"result {index} analyses")
+
+    auxgraphs = message.get("auxiliary_graphs")
+    if auxgraphs is not None:
+        _expect(auxgraphs, dict, "message.auxiliary_graphs")
+        for auxgraph_id, auxgraph in auxgraphs.items():
+            _expect(auxgraph, dict, f"auxiliary graph {auxgraph_id}")
+            _expect(auxgraph.get("edges"), list, f"auxiliary graph {auxgraph_id} edges")
+
+
+def parse_message(obj: dict) -> Message:
+    """Parse a TRAPI message in a single validation pass.
+
+    Message.parse_obj validates the whole message and then parses every
+    component again; the components alone are enough.
+    """
+    message = Message()
+    if obj.get("query_graph") is not None:
+        message.query_graph = QueryGraph.parse_obj(obj["query_graph"])
+    if obj.get("knowledge_graph") is not None:
+        message.knowledge_graph = KnowledgeGraph.parse_obj(obj["knowledge_graph"])
+    if obj.get("results") is not None:
+        message.results = Results.parse_obj(obj["results"])
+    if obj.get("auxiliary_graphs") is not None:
+        message.auxiliary_graphs = AuxiliaryGraphs.parse_obj(obj["auxiliary_graphs"])
+    if message.knowledge_graph:
+        message._normalize_kg_edge_ids()
+    return message
@@ -1,9 +1,15 @@
 """Logging setup."""
 from datetime import datetime
 import logging
+import os
 from typing import Optional
 import uuid
 
+from .serialization import dumps
+
+# Log entries kept per query, and their total size when serialized
+LOG_MAX_ENTRIES = int(os.getenv("LOG_MAX_ENTRIES", 1000))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 1024 * 1024))
 
 
 class TRAPILogEntryFormatter(logging.Formatter):
@@ -12,9 +18,9 @@ class TRAPILogEntryFormatter(logging.Formatter):
     def format(self, record):
         log_entry = {}
 
-        # If given a string use that as the message
+        # If given a string use that, with any %-style arguments, as the message
         if isinstance(record.msg, str):
-            log_entry["message"] = record.msg
+            log_entry["message"] = record.getMessage()
 
         # If given a dict, just use that as the log entry
         # Make sure everything is serializeable
@@ -34,21 +40,59 @@ class TRAPILogEntryFormatter(logging.Formatter):
 
 
 class ListLogHandler(logging.Handler):
-    """List log handler."""
+    """List log handler.
+
+    Keeps at most max_entries entries, and max_bytes of them when serialized.
+    Later entries are dropped and counted, a final entry says how many.
+    """
 
-    def __init__(self, **kwargs):
-        self.store = []
+    def __init__(self, max_entries: int = LOG_MAX_ENTRIES, max_bytes: int = LOG_MAX_BYTES, **kwargs):
+        self.entries = []
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.dropped = 0
         super().__init__(**kwargs)
 
+    @property
+    def store(self) -> list[dict]:
+        if not self.dropped:
+            return self.entries
+        return self.entries + [{
+            "message": f"{self.dropped} log entries were dropped, the log is limited to "
+                       f"{self.max_entries} entries and {self.max_bytes} bytes",
+            "timestamp": datetime.utcnow().isoformat(),
+            "level": "WARNING",
+        }]
+
     def emit(self, record):
-        log_entry = self.format(record)
-        self.store.append(log_entry)
+        if self.dropped or len(self.entries) >= self.max_entries:
+            self.dropped += 1
+            return
+        try:
+            log_entry = self.format(record)
+            size = len(dumps(log_entry))
+        except Exception:
+            # An entry that cannot be serialized is reported, not raised to the caller
+            self.handleError(record)
+            return
+        if self.size + size > self.max_bytes:
+            self.dropped += 1
+            return
+        self.size += size
+        self.entries.append(log_entry)
 
 
 def gen_logger(name: Optional[str] = None, **kwargs):
+    """Generate a logger collecting TRAPI log entries.
+
+    The logger is not registered with the logging module, so it is released
+    with the query that uses it. Entries still propagate to the root logger.
+    """
     if name is None:
         name = str(uuid.uuid4())
-    logger = logging.getLogger(name)
+    logger = logging.Logger(name)
+    logger.parent = logging.getLogger()
     formatter = TRAPILogEntryFormatter()
     handler = ListLogHandler(**kwargs)
     handler.setFormatter(formatter)
@@ -0,0 +1,210 @@
+"""Load test /query against local stub services.
+
+Starts the stub registries, normalizer and KPs (benchmarks.stubs) and a
+workflow runner pointed at them, each in its own process, then runs /query
+workloads for every combination of workflow length, provider count and
+message size. Reports throughput, latency percentiles and the runner's peak
+RSS:
+
+    python -m benchmarks.load --operations 1 3 --providers 2 8 --results 100 1000
+"""
+import argparse
+import asyncio
+from contextlib import contextmanager
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import httpx
+
+from benchmarks.merge import QGRAPH
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until(url: str, ready=lambda response: True, timeout: float = 60.0):
+    """Poll url until it answers, and ready says so."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = httpx.get(url, timeout=1.0)
+            if response.status_code == 200 and ready(response):
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"{url} did not come up within {timeout} seconds")
+
+
+@contextmanager
+def process(args: list[str], env: Optional[dict] = None):
+    """Run a Python module in a subprocess for the duration of the block."""
+    proc = subprocess.Popen(
+        [sys.executable, "-m", *args],
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        yield proc
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def peak_rss(pid: int) -> Optional[int]:
+    """Get the peak resident set size of a running process in bytes, on Linux."""
+    try:
+        with open(f"/proc/{pid}/status") as stream:
+            for line in stream:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def query(operations: int) -> dict:
+    """Build a query running a lookup and then operations - 1 more operations."""
+    workflow = [{"id": "lookup"}]
+    for _ in range(operations - 1):
+        workflow.append({
+            "id": "sort_results_score",
+            "parameters": {"ascending_or_descending": "descending"},
+        })
+    return {"message": {"query_graph": QGRAPH}, "workflow": workflow}
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile."""
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+async def run_load(url: str, payload: dict, requests: int, concurrency: int) -> dict:
+    """Send requests to url, concurrency at a time."""
+    latencies = []
+    errors = 0
+    pending = iter(range(requests))
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        async def worker():
+            nonlocal errors
+            for _ in pending:
+                start = time.perf_counter()
+                response = await client.post(url, json=payload)
+                if response.status_code != 200:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / elapsed,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+    }
+
+
+def run_scenario(
+    operations: int,
+    providers: int,
+    results: int,
+    latency: float,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+) -> dict:
+    """Start fresh stubs and a fresh runner, and load test them."""
+    stub_port, runner_port = free_port(), free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    runner_url = f"http://127.0.0.1:{runner_port}"
+    env = {
+        "SMARTAPI_URL": f"{stub_url}/smartapi",
+        "OPERATIONS_SCHEMA_URL": f"{stub_url}/operations/schema",
+        "NORMALIZER_URL": f"{stub_url}/normalizer",
+        # Always start from the stub registries
+        "REGISTRY_SNAPSHOT_PATH": "",
+    }
+    with process([
+        "benchmarks.stubs",
+        "--port", str(stub_port),
+        "--providers", str(providers),
+        "--latency", str(latency),
+        "--results", str(results),
+    ]):
+        wait_until(f"{stub_url}/operations/schema")
+        with process([
+            "uvicorn", "app.server:APP",
+            "--port", str(runner_port),
+            "--log-level", "warning",
+        ], env=env) as runner:
+            wait_until(f"{runner_url}/services", ready=lambda response: bool(response.json()))
+            payload = query(operations)
+            if warmup:
+                asyncio.run(run_load(f"{runner_url}/query", payload, warmup, 1))
+            report = asyncio.run(run_load(f"{runner_url}/query", payload, requests, concurrency))
+            report["peak_rss"] = peak_rss(runner.pid)
+    return {
+        "operations": operations,
+        "providers": providers,
+        "results": results,
+        **report,
+    }
+
+
+def main():
+    """Run CLI."""
+    argparser = argparse.ArgumentParser(description="Load test /query against stub services")
+    argparser.add_argument("--operations", type=int, nargs="+", default=[1, 3], help="workflow lengths")
+    argparser.add_argument("--providers", type=int, nargs="+", default=[2, 8], help="KPs per operation")
+    argparser.add_argument("--results", type=int, nargs="+", default=[100, 1000], help="results per KP lookup")
+    argparser.add_argument("--latency", type=float, default=0.1, help="KP latency in seconds")
+    argparser.add_argument("--requests", type=int, default=20)
+    argparser.add_argument("--concurrency", type=int, default=4)
+    argparser.add_argument("--warmup", type=int, default=2)
+    argparser.add_argument("--json", help="also write the reports to this file")
+    args = argparser.parse_args()
+
+    print(
+        f"{'ops':>4} {'kps':>4} {'results':>8} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+        f"{'errors':>7} {'peak RSS':>9}"
+    )
+    reports = []
+    for operations, providers, results in itertools.product(args.operations, args.providers, args.results):
+        report = run_scenario(
+            operations,
+            providers,
+            results,
+            args.latency,
+            args.requests,
+            args.concurrency,
+            args.warmup,
+        )
+        reports.append(report)
+        rss = "n/a" if report["peak_rss"] is None else f"{report['peak_rss'] / 2 ** 20:.0f}MiB"
+        print(
+            f"{operations:>4} {providers:>4} {results:>8} {report['throughput']:>8.2f} "
+            f"{report['p50']:>7.3f}s {report['p95']:>7.3f}s {report['p99']:>7.3f}s "
+            f"{report['errors']:>7} {rss:>9}"
+        )
+    if args.json:
+        with open(args.json, "w") as stream:
+            json.dump(reports, stream, indent=2)
+
+
+if __name__ == "__main__":
+    main()
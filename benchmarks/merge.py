@@ -0,0 +1,123 @@
+"""Benchmark merging lookup responses.
+
+Compares the reasoner-pydantic merge (parse every response, Message.update,
+dump back to a dict) with the dict-level merge engine in app.merge.
+
+    python -m benchmarks.merge --providers 4 --results 5000
+"""
+import argparse
+import time
+
+from reasoner_pydantic import Message, QueryGraph, Response
+
+from app.merge import merge_messages
+
+QGRAPH = {
+    "nodes": {
+        "n0": {"categories": ["biolink:ChemicalEntity"]},
+        "n1": {"ids": ["MONDO:0005148"], "categories": ["biolink:Disease"]},
+    },
+    "edges": {
+        "e0": {"subject": "n0", "object": "n1", "predicates": ["biolink:treats"]},
+    },
+}
+
+
+def lookup_message(provider: int, num_results: int, overlap: float) -> dict:
+    """Build a lookup response from one provider.
+
+    A fraction of the answers (overlap) is shared by all providers.
+    """
+    shared = int(num_results * overlap)
+    nodes = {
+        "MONDO:0005148": {
+            "categories": ["biolink:Disease"],
+            "name": "type 2 diabetes mellitus",
+            "attributes": [],
+        },
+    }
+    edges = {}
+    results = []
+    for index in range(num_results):
+        curie = f"CHEBI:{index}" if index < shared else f"CHEBI:{provider}{index:07d}"
+        edge_id = f"p{provider}-e{index}"
+        nodes[curie] = {
+            "categories": ["biolink:SmallMolecule"],
+            "name": f"chemical {index}",
+            "attributes": [
+                {"attribute_type_id": "biolink:description", "value": f"provider {provider}"},
+            ],
+        }
+        edges[edge_id] = {
+            "subject": curie,
+            "object": "MONDO:0005148",
+            "predicate": "biolink:treats",
+            "sources": [
+                {"resource_id": f"infores:kp{provider}", "resource_role": "primary_knowledge_source"},
+            ],
+            "attributes": [],
+        }
+        results.append({
+            "node_bindings": {
+                "n0": [{"id": curie, "attributes": []}],
+                "n1": [{"id": "MONDO:0005148", "attributes": []}],
+            },
+            "analyses": [{
+                "resource_id": f"infores:kp{provider}",
+                "edge_bindings": {"e0": [{"id": edge_id, "attributes": []}]},
+                "score": index / num_results,
+            }],
+        })
+    return {
+        "query_graph": QGRAPH,
+        "knowledge_graph": {"nodes": nodes, "edges": edges},
+        "results": results,
+        "auxiliary_graphs": {},
+    }
+
+
+def pydantic_merge(messages: list[dict]) -> dict:
+    """Merge the way run_workflow used to."""
+    m = Message(query_graph=QueryGraph.parse_obj(QGRAPH))
+    for message in messages:
+        m.update(Message.parse_obj(message))
+    return m.dict()
+
+
+def dict_merge(messages: list[dict]) -> dict:
+    """Merge with the dict-level engine."""
+    return merge_messages(QGRAPH, messages)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    value = func(*args)
+    return value, time.perf_counter() - start
+
+
+def main():
+    """Run CLI."""
+    argparser = argparse.ArgumentParser(description="Benchmark message merging")
+    argparser.add_argument("--providers", type=int, default=4)
+    argparser.add_argument("--results", type=int, nargs="+", default=[100, 1000, 5000])
+    argparser.add_argument("--overlap", type=float, default=0.5)
+    args = argparser.parse_args()
+
+    print(f"{'results':>8} {'pydantic':>10} {'dict':>10} {'dict+Response':>14} {'speedup':>8}")
+    for num_results in args.results:
+        messages = [
+            lookup_message(provider, num_results, args.overlap)
+            for provider in range(args.providers)
+        ]
+        _, pydantic_time = timed(pydantic_merge, messages)
+        merged, dict_time = timed(dict_merge, messages)
+        _, response_time = timed(lambda: Response(message=merged))
+        total = dict_time + response_time
+        print(
+            f"{num_results:>8} {pydantic_time:>9.3f}s {dict_time:>9.3f}s "
+            f"{total:>13.3f}s {pydantic_time / total:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Local stand-ins for the services the workflow runner depends on.
+
+One app serves the SmartAPI registry, the operations schema, the node
+normalizer and any number of TRAPI KPs, so benchmarks never leave the
+machine:
+
+    python -m benchmarks.stubs --port 8900 --providers 4 --latency 0.2 --results 1000
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+
+from fastapi import FastAPI, Request
+from starlette.responses import Response
+
+from benchmarks.merge import lookup_message
+
+OPERATIONS = {
+    "OperationLookup": {"id": "lookup", "unique": True},
+    "OperationSortResultsScore": {"id": "sort_results_score", "unique": False},
+    "OperationFilterResultsTopN": {"id": "filter_results_top_n", "unique": False},
+}
+
+
+def registry_hit(base_url: str, provider: int, maturity: str, trapi_version: str) -> dict:
+    """Build a SmartAPI registry entry for a stub KP."""
+    return {
+        "info": {
+            "title": f"Stub KP {provider}",
+            "x-translator": {"infores": f"infores:kp{provider}"},
+            "x-trapi": {
+                "version": trapi_version,
+                "operations": [operation["id"] for operation in OPERATIONS.values()],
+            },
+        },
+        "paths": {"/query": {}},
+        "servers": [{"url": f"{base_url}/kp/{provider}", "x-maturity": maturity}],
+        "_meta": {"url": f"{base_url}/kp/{provider}/openapi.json"},
+    }
+
+
+def operations_schema() -> dict:
+    """Build an operations schema like the one on standards.ncats.io."""
+    defs = {}
+    for title, operation in OPERATIONS.items():
+        properties = {"id": {"enum": [operation["id"]]}}
+        if operation["unique"]:
+            properties["unique"] = {"const": True}
+        defs[title] = {"description": f"Stub {operation['id']}", "properties": properties}
+    return {"$defs": defs}
+
+
+def conditional(request: Request, document: dict) -> Response:
+    """Serve a document with an ETag, or 304 if the client has it already."""
+    body = json.dumps(document).encode()
+    etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"etag": etag})
+    return Response(body, media_type="application/json", headers={"etag": etag})
+
+
+async def request_json(request: Request):
+    """Decode a JSON request body, gzipped or not."""
+    body = await request.body()
+    if request.headers.get("content-encoding") == "gzip":
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+
+def normalize(curie: str) -> dict:
+    """Normalize a CURIE to itself."""
+    return {
+        "id": {"identifier": curie, "label": curie},
+        "equivalent_identifiers": [{"identifier": curie}],
+        "type": ["biolink:SmallMolecule", "biolink:ChemicalEntity"],
+    }
+
+
+def create_app(
+    base_url: str,
+    providers: int = 4,
+    latency: float = 0.0,
+    results: int = 100,
+    overlap: float = 0.5,
+    maturity: str = "development",
+    trapi_version: str = "1.5.0",
+) -> FastAPI:
+    """Create the stub services.
+
+    KPs answer lookups with a message of the configured size after the
+    configured latency, and echo the message back for every other operation.
+    """
+    app = FastAPI()
+    lookups = {
+        provider: lookup_message(provider, results, overlap)
+        for provider in range(providers)
+    }
+
+    @app.get("/smartapi/query")
+    async def smartapi(request: Request):
+        return conditional(request, {"hits": [
+            registry_hit(base_url, provider, maturity, trapi_version)
+            for provider in range(providers)
+        ]})
+
+    @app.get("/operations/schema")
+    async def operations(request: Request):
+        return conditional(request, operations_schema())
+
+    @app.post("/normalizer/get_normalized_nodes")
+    async def normalizer(request: Request):
+        body = await request_json(request)
+        return {curie: normalize(curie) for curie in body["curies"]}
+
+    @app.get("/kp/{provider}/query")
+    async def probe(provider: int):
+        return {}
+
+    @app.post("/kp/{provider}/query")
+    async def kp(provider: int, request: Request):
+        body = await request_json(request)
+        await asyncio.sleep(latency)
+        if body["workflow"][0]["id"] == "lookup":
+            return {"message": lookups[provider]}
+        return {"message": body["message"]}
+
+    return app
+
+
+def main():
+    """Run CLI."""
+    import uvicorn
+
+    argparser = argparse.ArgumentParser(description="Serve stub registries, normalizer and KPs")
+    argparser.add_argument("--port", type=int, default=8900)
+    argparser.add_argument("--providers", type=int, default=4)
+    argparser.add_argument("--latency", type=float, default=0.0)
+    argparser.add_argument("--results", type=int, default=100)
+    argparser.add_argument("--overlap", type=float, default=0.5)
+    args = argparser.parse_args()
+
+    app = create_app(
+        f"http://127.0.0.1:{args.port}",
+        providers=args.providers,
+        latency=args.latency,
+        results=args.results,
+        overlap=args.overlap,
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
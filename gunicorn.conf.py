@@ -0,0 +1,23 @@
+"""Gunicorn configuration for running several workers.
+
+The master resolves services and operations once and saves them to the
+registry snapshot, workers serve it and pick up the snapshots saved by
+the worker that refreshes it, or by POST /refresh on any worker.
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault("REGISTRY_SHARED", "true")
+
+bind = f"0.0.0.0:{os.getenv('PORT', 3084)}"
+workers = int(os.getenv("WORKERS", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Import the app once in the master, workers are forked from it
+preload_app = True
+
+
+def on_starting(server):
+    """Resolve the registry before the workers start."""
+    from app.server import refresh_shared_registry
+
+    refresh_shared_registry()
@@ -1,6 +1,7 @@
 #!/usr/bin/env bash
 
 PORT=3084
+WORKERS=${WORKERS:-1}
 
 # https://stackoverflow.com/a/14203146
 POSITIONAL=()
@@ -14,6 +15,11 @@ case $key in
     shift # past argument
     shift # past value
     ;;
+    -w|--workers)
+    WORKERS="$2"
+    shift # past argument
+    shift # past value
+    ;;
     *)    # unknown option
     POSITIONAL+=("$1") # save it in an array for later
     shift # past argument
@@ -21,4 +27,8 @@ case $key in
 esac
 done
 
-uvicorn app.server:APP --host 0.0.0.0 --port $PORT
+if [[ $WORKERS -gt 1 ]]; then
+    PORT=$PORT WORKERS=$WORKERS gunicorn app.server:APP -c gunicorn.conf.py
+else
+    uvicorn app.server:APP --host 0.0.0.0 --port $PORT
+fi
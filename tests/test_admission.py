@@ -0,0 +1,102 @@
+"""Test admission control, upstream concurrency limits and coalescing."""
+import asyncio
+
+import httpx
+import pytest
+
+from app import util
+from app.admission import AdmissionQueue
+from app.util import post_safely
+
+
+@pytest.mark.asyncio
+async def test_admission_queue():
+    """Test that queries wait for a slot, and are rejected when the queue is full."""
+    admission = AdmissionQueue(limit=1, queue_size=1)
+    assert await admission.acquire() == 0.0
+    waiting = asyncio.create_task(admission.acquire())
+    await asyncio.sleep(0.01)
+    with pytest.raises(asyncio.QueueFull):
+        await admission.acquire()
+    await admission.release()
+    assert await waiting > 0
+    await admission.release()
+    assert await admission.acquire() == 0.0
+
+
+@pytest.mark.asyncio
+async def test_upstream_concurrency(monkeypatch):
+    """Test that concurrent requests to one URL are limited."""
+    monkeypatch.setattr(util, "SERVICE_SLOTS", {})
+    monkeypatch.setattr(util, "UPSTREAM_CONCURRENCY_LIMITS", {"http://kp/query": 2})
+    in_flight = peak = 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200, json={})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        await asyncio.gather(*(
+            post_safely("http://kp/query", {"request": index}, client, validation=None)
+            for index in range(6)
+        ))
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_coalescing(monkeypatch):
+    """Test that identical concurrent requests share one upstream request."""
+    monkeypatch.setattr(util, "IN_FLIGHT", {})
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.content)
+        await asyncio.sleep(0.05)
+        if b"fail" in request.content:
+            return httpx.Response(500)
+        return httpx.Response(200, json={"ok": True})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        def post(payload):
+            return post_safely("http://kp/query", payload, client, validation=None)
+
+        responses = await asyncio.gather(post({"a": 1}), post({"a": 1}), post({"a": 2}))
+        assert responses == [{"ok": True}] * 3
+        assert len(requests) == 2
+
+        # Key order does not matter
+        await asyncio.gather(post({"a": 1, "b": {"c": 1, "d": 2}}), post({"b": {"d": 2, "c": 1}, "a": 1}))
+        assert len(requests) == 3
+
+        failures = await asyncio.gather(post({"fail": 1}), post({"fail": 1}), return_exceptions=True)
+        assert all(isinstance(failure, RuntimeError) for failure in failures)
+        assert len(requests) == 4
+
+        # The request goes on while anyone waits for it
+        first, second = asyncio.create_task(post({"a": 3})), asyncio.create_task(post({"a": 3}))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == {"ok": True}
+        assert len(requests) == 5
+
+        # and is cancelled once everyone left
+        first, second = asyncio.create_task(post({"a": 4})), asyncio.create_task(post({"a": 4}))
+        await asyncio.sleep(0.01)
+        shared = next(iter(util.IN_FLIGHT.values()))
+        first.cancel()
+        second.cancel()
+        await asyncio.gather(first, second, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert shared.task.cancelled()
+        assert not util.IN_FLIGHT
+
+        # An identical request right after that gets a request of its own
+        first = asyncio.create_task(post({"a": 5}))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        second = asyncio.create_task(post({"a": 5}))
+        assert await second == {"ok": True}
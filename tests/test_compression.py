@@ -0,0 +1,157 @@
+"""Test compressed transport."""
+import gzip
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import httpx
+import pytest
+from starlette.responses import PlainTextResponse, StreamingResponse
+
+from app import compression, util
+from app.compression import CompressionMiddleware, ResponseTooLarge, fetch_json, post_json
+from app.diagnostics import DIAGNOSTIC_BODY_BYTES
+from app.wfr_logging import gen_logger
+
+PAYLOAD = {"message": {"results": [{"id": index} for index in range(10000)]}}
+
+
+def echo(accept_gzip: bool):
+    """Build a service that echoes JSON, with or without gzip support."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = request.content
+        encoding = request.headers.get("content-encoding")
+        requests.append(encoding)
+        if encoding == "gzip":
+            if not accept_gzip:
+                return httpx.Response(400, json={"detail": "JSON decode error"})
+            body = gzip.decompress(body)
+        return httpx.Response(200, json=json.loads(body))
+
+    return httpx.MockTransport(handler), requests
+
+
+@pytest.mark.asyncio
+async def test_post_json_compressed(monkeypatch):
+    """Test that large bodies are sent gzipped."""
+    monkeypatch.setattr(compression, "REQUEST_ENCODING", "gzip")
+    monkeypatch.setattr(compression, "ACCEPTS_COMPRESSION", {})
+    transport, requests = echo(accept_gzip=True)
+    async with httpx.AsyncClient(transport=transport) as client:
+        response = await post_json(client, "http://kp/query", PAYLOAD)
+        assert response.json() == PAYLOAD
+        await post_json(client, "http://kp/query", {"message": {}})
+    assert requests == ["gzip", None]
+
+
+@pytest.mark.asyncio
+async def test_post_json_fallback(monkeypatch):
+    """Test falling back to plain bodies for services that reject gzip."""
+    monkeypatch.setattr(compression, "REQUEST_ENCODING", "gzip")
+    monkeypatch.setattr(compression, "ACCEPTS_COMPRESSION", {})
+    transport, requests = echo(accept_gzip=False)
+    async with httpx.AsyncClient(transport=transport) as client:
+        response = await post_json(client, "http://kp/query", PAYLOAD)
+        assert response.json() == PAYLOAD
+        await post_json(client, "http://kp/query", PAYLOAD)
+    # The service is remembered, and sent plain bodies only
+    assert requests == ["gzip", None, None]
+
+
+@pytest.mark.asyncio
+async def test_post_json_server_error(monkeypatch):
+    """Test that server errors are not taken for rejected compression."""
+    monkeypatch.setattr(compression, "REQUEST_ENCODING", "gzip")
+    monkeypatch.setattr(compression, "ACCEPTS_COMPRESSION", {})
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.headers.get("content-encoding"))
+        return httpx.Response(500)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        response = await post_json(client, "http://kp/query", PAYLOAD)
+    assert response.status_code == 500
+    assert requests == ["gzip"]
+    assert "http://kp/query" not in compression.ACCEPTS_COMPRESSION
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("incremental", [False, True])
+async def test_fetch_json(monkeypatch, incremental):
+    """Test that responses are decoded as they stream in, up to a limit."""
+    if incremental:
+        pytest.importorskip("ijson")
+    else:
+        monkeypatch.setattr(compression, "ijson", None)
+    body = json.dumps(PAYLOAD).encode()
+    sent = []
+
+    async def chunks():
+        for start in range(0, len(body), 1024):
+            sent.append(start)
+            yield body[start:start + 1024]
+
+    status = 200
+    transport = httpx.MockTransport(lambda request: httpx.Response(status, content=chunks()))
+    async with httpx.AsyncClient(transport=transport) as client:
+        assert await fetch_json(client, "http://kp/query", {}) == (PAYLOAD, len(body))
+        sent.clear()
+        with pytest.raises(ResponseTooLarge):
+            await fetch_json(client, "http://kp/query", {}, max_bytes=10000)
+        # Reading stopped at the limit
+        assert len(sent) == 10
+
+        # Error bodies are read only as far as they are logged
+        status = 500
+        sent.clear()
+        with pytest.raises(httpx.HTTPStatusError) as error:
+            await fetch_json(client, "http://kp/query", {})
+        assert len(sent) == DIAGNOSTIC_BODY_BYTES // 1024 + 1
+        assert error.value.response.content == body[:len(sent) * 1024]
+
+
+@pytest.mark.asyncio
+async def test_response_limit(monkeypatch):
+    """Test that oversized responses are not read, and the failure is logged."""
+    monkeypatch.setattr(util, "UPSTREAM_RESPONSE_BYTES_LIMITS", {"http://kp/query": 1000})
+    monkeypatch.setattr(util, "OPERATION_RESPONSE_BYTES_LIMITS", {"lookup": 100, "score": 0})
+    assert util.response_limit("http://kp/query", "lookup") == 100
+    assert util.response_limit("http://kp/query", "score") == 1000
+    assert util.response_limit("http://other/query", "score") is None
+    assert util.response_limit("http://other/query", "") == util.UPSTREAM_MAX_RESPONSE_BYTES
+
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json=PAYLOAD))
+    logger = gen_logger()
+    async with httpx.AsyncClient(transport=transport) as client:
+        with pytest.raises(RuntimeError):
+            await util.post_safely("http://kp/query", {"message": {}}, client, logger=logger, validation=None)
+    entry = logger.handlers[0].store[0]
+    assert entry["message"] == "Response from http://kp/query is larger than the 1000 bytes allowed, stopped reading it"
+
+
+def test_compression_middleware():
+    """Test that large complete responses are gzipped and streams are not."""
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+    @app.get("/large")
+    async def large():
+        return PlainTextResponse("x" * 1000)
+
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            for _ in range(10):
+                yield "x" * 100 + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    client = TestClient(app)
+    response = client.get("/large", headers={"accept-encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == "x" * 1000
+    response = client.get("/stream", headers={"accept-encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert len(response.text.splitlines()) == 10
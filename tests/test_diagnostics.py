@@ -0,0 +1,62 @@
+"""Test diagnostics of failed upstream requests."""
+import copy
+import json
+import logging
+
+import httpx
+import pytest
+
+from app import util
+from app.diagnostics import capture, preview, summarize_payload
+from app.util import post_safely
+from app.wfr_logging import gen_logger
+
+PAYLOAD = {
+    "message": {
+        "query_graph": {"nodes": {
+            "n0": {"ids": [f"CHEBI:{index}" for index in range(100)]},
+            "n1": {"ids": ["MONDO:0005148"]},
+        }, "edges": {}},
+        "knowledge_graph": {"nodes": {f"CHEBI:{index}": {} for index in range(100)}, "edges": {}},
+        "results": [{"node_bindings": {}} for _ in range(100)],
+    },
+    "workflow": [{"id": "lookup"}],
+}
+
+
+def test_summarize_payload():
+    """Test that payloads are summarized without being modified."""
+    original = copy.deepcopy(PAYLOAD)
+    summary = summarize_payload(PAYLOAD)
+    assert PAYLOAD == original
+    qnodes = summary["message"]["query_graph"]["nodes"]
+    assert qnodes["n0"]["ids"] == "**100 CURIEs not shown for brevity**"
+    assert qnodes["n1"] is PAYLOAD["message"]["query_graph"]["nodes"]["n1"]
+    assert summary["message"]["knowledge_graph"]["nodes"] == "**100 nodes not shown for brevity**"
+    assert summary["message"]["results"] == "**100 results not shown for brevity**"
+    assert summary["workflow"] == [{"id": "lookup"}]
+    assert summarize_payload({"curies": ["a"] * 11}) == {"curies": "**11 items not shown for brevity**"}
+    assert preview(b"x" * 10, limit=4) == "xxxx... (10 bytes in total)"
+
+
+@pytest.mark.asyncio
+async def test_failure_logs(tmp_path, monkeypatch):
+    """Test that failures log bounded bodies, and capture full ones when enabled."""
+    body = b"error " * 10000
+    transport = httpx.MockTransport(lambda request: httpx.Response(500, content=body))
+    logger = gen_logger()
+    logger.setLevel(logging.WARNING)
+    monkeypatch.setattr(util, "DEBUG_CAPTURE_DIR", None)
+    async with httpx.AsyncClient(transport=transport) as client:
+        with pytest.raises(RuntimeError):
+            await post_safely("http://kp/query", PAYLOAD, client, logger=logger)
+    entry = logger.handlers[0].store[0]
+    assert len(entry["response"]["data"]) < 5000
+    assert entry["request"]["data"]["message"]["results"] == "**100 results not shown for brevity**"
+    assert "capture" not in entry
+
+    path = await capture("kp", PAYLOAD, httpx.Response(500, content=body), directory=str(tmp_path))
+    with open(path + ".request.json") as stream:
+        assert json.load(stream) == {"service": "kp", "payload": PAYLOAD}
+    with open(path + ".response", "rb") as stream:
+        assert stream.read() == body
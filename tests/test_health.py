@@ -0,0 +1,58 @@
+"""Test service health tracking."""
+import time
+
+from app.health import HealthTracker
+
+SERVICES = [
+    {"title": "slow", "url": "http://slow"},
+    {"title": "flaky", "url": "http://flaky"},
+    {"title": "fast", "url": "http://fast"},
+    {"title": "new", "url": "http://new"},
+]
+
+
+def test_order():
+    """Test that healthy, fast services are tried first."""
+    health = HealthTracker()
+    health.record("http://slow", True, 5.0)
+    health.record("http://flaky", False, 0.1)
+    health.record("http://fast", True, 0.5)
+    assert [service["title"] for service in health.order(SERVICES)] == ["new", "fast", "slow", "flaky"]
+
+
+def test_circuit_breaker():
+    """Test opening, half-opening and closing a circuit."""
+    health = HealthTracker(failure_threshold=2, reset_timeout=0.05)
+    health.record("http://flaky", False, 0.1)
+    assert health.allow("http://flaky")
+    health.record("http://flaky", False, 0.1)
+    allowed, skipped = health.select(SERVICES)
+    assert skipped == [SERVICES[1]]
+    assert health.score("http://flaky")["state"] == "open"
+
+    time.sleep(0.06)
+    # Only one trial request gets through a half-open circuit
+    assert health.allow("http://flaky")
+    assert not health.allow("http://flaky")
+    health.record("http://flaky", False, 0.1)
+    assert health.score("http://flaky")["state"] == "open"
+
+    time.sleep(0.06)
+    # A cancelled trial gives its place back
+    assert health.allow("http://flaky")
+    health.release("http://flaky")
+    assert health.allow("http://flaky")
+    health.record("http://flaky", True, 0.1)
+    assert health.score("http://flaky")["state"] == "closed"
+    assert health.score("http://flaky")["error_rate"] == 0.75
+
+
+def test_select_does_not_claim():
+    """Test that only querying a half-open service claims its trial."""
+    health = HealthTracker(failure_threshold=1, reset_timeout=0.05)
+    health.record("http://flaky", False, 0.1)
+    time.sleep(0.06)
+    assert health.select(SERVICES)[0] == SERVICES
+    assert health.select(SERVICES)[0] == SERVICES
+    assert health.allow("http://flaky")
+    assert health.select(SERVICES)[1] == [SERVICES[1]]
@@ -0,0 +1,35 @@
+"""Test shared HTTP client."""
+import asyncio
+
+import httpx
+import pytest
+
+from app.http_client import HostLimitTransport
+
+
+@pytest.mark.asyncio
+async def test_host_limit():
+    """Test that concurrent requests are capped per host."""
+    in_flight = {"a.org": 0, "b.org": 0}
+    peak = {"a.org": 0, "b.org": 0}
+
+    async def handler(request):
+        host = request.url.host
+        in_flight[host] += 1
+        peak[host] = max(peak[host], in_flight[host])
+        await asyncio.sleep(0.01)
+        in_flight[host] -= 1
+        return httpx.Response(200, json={})
+
+    transport = HostLimitTransport(
+        httpx.MockTransport(handler),
+        max_per_host=2,
+        host_limits={"b.org": 3},
+    )
+    async with httpx.AsyncClient(transport=transport) as client:
+        await asyncio.gather(*(
+            client.post(f"http://{host}/query", json={})
+            for host in ("a.org", "b.org")
+            for _ in range(10)
+        ))
+    assert peak == {"a.org": 2, "b.org": 3}
@@ -0,0 +1,39 @@
+"""Test asynchronous query jobs."""
+import asyncio
+
+import pytest
+
+from app.jobs import JobQueue
+from app.wfr_logging import gen_logger
+
+
+@pytest.mark.asyncio
+async def test_job_queue():
+    """Test running queued queries and polling their status."""
+    release = asyncio.Event()
+
+    async def run(request_dict, logger):
+        await release.wait()
+        return {"message": request_dict["message"], "logs": []}
+
+    jobs = JobQueue(run, workers=1, maxsize=1, retention=60)
+    await jobs.start()
+    try:
+        request = {"message": {}, "callback": "http://127.0.0.1:1/callback"}
+        running = jobs.submit(dict(request), gen_logger())
+        await asyncio.sleep(0)
+        queued = jobs.submit(dict(request), gen_logger())
+        assert (running.status, queued.status) == ("Running", "Queued")
+        # The queue only holds one waiting job
+        with pytest.raises(asyncio.QueueFull):
+            jobs.submit(dict(request), gen_logger())
+
+        release.set()
+        for _ in range(100):
+            if queued.status == "Completed":
+                break
+            await asyncio.sleep(0.01)
+        assert jobs.get(running.id).status == "Completed"
+        assert jobs.get(queued.id).response["status"] == "Success"
+    finally:
+        await jobs.stop()
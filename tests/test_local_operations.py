@@ -0,0 +1,122 @@
+"""Test in-process standard operations."""
+import copy
+import logging
+
+from app.local_operations import (
+    compact_message,
+    filter_kgraph_orphans,
+    filter_results_top_n,
+    resolve_parameters,
+    run_local_operation,
+    sort_results_score,
+)
+from app.serialization import dumps
+
+LOGGER = logging.getLogger(__name__)
+
+OPERATIONS = {
+    "sort_results_score": {
+        "properties": {"parameters": {"$ref": "#/$defs/SortResultsScoreParameters"}},
+    },
+    "SortResultsScoreParameters": {
+        "properties": {"ascending_or_descending": {"enum": ["ascending", "descending"]}},
+        "required": ["ascending_or_descending"],
+    },
+    "filter_results_top_n": {
+        "properties": {"parameters": {
+            "properties": {"max_results": {"default": 2}},
+            "required": ["max_results"],
+        }},
+    },
+    "filter_kgraph_orphans": {"properties": {}},
+    "enrich_results": {"properties": {}},
+}
+
+
+def result(node_id, *scores, edge_ids=(), support_graphs=()):
+    return {
+        "node_bindings": {"n0": [{"id": node_id}]},
+        "analyses": [
+            {
+                "score": score,
+                "edge_bindings": {"e0": [{"id": edge_id} for edge_id in edge_ids]},
+                "support_graphs": list(support_graphs),
+            }
+            for score in scores
+        ],
+    }
+
+
+def test_sort_results_score():
+    """Test that results are sorted by their best score, unscored results last."""
+    message = {"results": [result("a", 0.1), result("b", None), result("c", 0.2, 0.9), result("d", 0.5)]}
+    original = copy.deepcopy(message)
+    for direction, expected in [("descending", "cdab"), ("ascending", "adcb")]:
+        sorted_message = sort_results_score(message, {"ascending_or_descending": direction})
+        ids = "".join(r["node_bindings"]["n0"][0]["id"] for r in sorted_message["results"])
+        assert ids == expected
+    assert message == original
+    assert filter_results_top_n(message, {"max_results": 1})["results"] == original["results"][:1]
+
+
+def test_filter_kgraph_orphans():
+    """Test that nodes, edges and auxiliary graphs the results use are kept."""
+    message = {
+        "knowledge_graph": {
+            "nodes": {node_id: {} for node_id in "abcdefg"},
+            "edges": {
+                "ab": {"subject": "a", "object": "b"},
+                "bc": {"subject": "b", "object": "c", "attributes": [
+                    {"attribute_type_id": "biolink:support_graphs", "value": ["aux2"]},
+                ]},
+                "de": {"subject": "d", "object": "e"},
+                "fg": {"subject": "f", "object": "g"},
+            },
+        },
+        "auxiliary_graphs": {"aux1": {"edges": ["bc"]}, "aux2": {"edges": ["de"]}, "aux3": {"edges": ["fg"]}},
+        "results": [result("a", 1.0, edge_ids=["ab"], support_graphs=["aux1"])],
+    }
+    original = copy.deepcopy(message)
+    filtered = filter_kgraph_orphans(message, {})
+    assert set(filtered["knowledge_graph"]["nodes"]) == set("abcde")
+    assert set(filtered["knowledge_graph"]["edges"]) == {"ab", "bc", "de"}
+    assert set(filtered["auxiliary_graphs"]) == {"aux1", "aux2"}
+    assert message == original
+
+
+def test_compact_message():
+    """Test that compaction reports the bytes it saves when serialized."""
+    message = {
+        "knowledge_graph": {
+            "nodes": {"a": {"name": "A"}, "b": {"name": "B"}, "c": {"name": "C"}},
+            "edges": {"ab": {"subject": "a", "object": "b"}, "bc": {"subject": "b", "object": "c"}},
+        },
+        "auxiliary_graphs": {"aux1": {"edges": ["bc"]}},
+        "results": [result("a", 1.0, edge_ids=["ab"])],
+    }
+    compacted, saved = compact_message(message)
+    assert set(compacted["knowledge_graph"]["nodes"]) == {"a", "b"}
+    assert compacted["auxiliary_graphs"] == {}
+    assert abs(len(dumps(message)) - len(dumps(compacted)) - saved) <= 1
+    assert compact_message({"knowledge_graph": message["knowledge_graph"], "results": None})[1] == 0
+
+
+def test_resolve_parameters():
+    """Test parameter definitions, defaults and required parameters."""
+    assert resolve_parameters("filter_results_top_n", {}, OPERATIONS) == {"max_results": 2}
+    assert resolve_parameters("sort_results_score", {}, OPERATIONS) is None
+    assert resolve_parameters(
+        "sort_results_score",
+        {"ascending_or_descending": "ascending"},
+        OPERATIONS,
+    ) == {"ascending_or_descending": "ascending"}
+    assert resolve_parameters("filter_kgraph_orphans", {}, OPERATIONS) == {}
+
+
+def test_run_local_operation():
+    """Test that unsupported or undefined operations fall back to remote."""
+    message = {"results": [result("a", 0.1), result("b", 0.2), result("c", 0.3)]}
+    top = run_local_operation({"id": "filter_results_top_n"}, message, OPERATIONS, LOGGER)
+    assert len(top["results"]) == 2
+    assert run_local_operation({"id": "enrich_results"}, message, OPERATIONS, LOGGER) is None
+    assert run_local_operation({"id": "filter_results_top_n"}, message, {}, LOGGER) is None
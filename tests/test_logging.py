@@ -0,0 +1,50 @@
+"""Test per-query logging."""
+import logging
+
+from app.wfr_logging import gen_logger
+
+
+def test_gen_logger():
+    """Test that query loggers are not registered and format lazily."""
+    logger = gen_logger()
+    assert logger.name not in logging.Logger.manager.loggerDict
+    logger.setLevel(logging.INFO)
+
+    class Expensive:
+        def __str__(self):
+            raise AssertionError("formatted below the log level")
+
+    logger.debug("skipped %s", Expensive())
+    logger.info("kept %d", 1)
+    logger.warning({"message": "dict", "error": "e"})
+    store = logger.handlers[0].store
+    assert [(entry["level"], entry["message"]) for entry in store] == [("INFO", "kept 1"), ("WARNING", "dict")]
+    assert store[1]["error"] == "e"
+
+
+def test_log_limits():
+    """Test that entries beyond the limits are dropped and counted."""
+    logger = gen_logger(max_entries=3)
+    logger.setLevel(logging.DEBUG)
+    for i in range(5):
+        logger.debug("entry %d", i)
+    store = logger.handlers[0].store
+    assert [entry["message"] for entry in store[:3]] == ["entry 0", "entry 1", "entry 2"]
+    assert store[3]["level"] == "WARNING" and store[3]["message"].startswith("2 log entries were dropped")
+
+    logger = gen_logger(max_bytes=200)
+    logger.setLevel(logging.DEBUG)
+    logger.debug("x" * 100)
+    logger.debug("x" * 100)
+    logger.debug("short")
+    assert len(logger.handlers[0].entries) == 1
+    assert logger.handlers[0].dropped == 2
+
+
+def test_unserializable_entry(monkeypatch):
+    """Test that an entry that cannot be serialized is dropped without failing the caller."""
+    monkeypatch.setattr(logging, "raiseExceptions", False)
+    logger = gen_logger()
+    logger.warning({"message": "bad", "error": object()})
+    logger.warning("good")
+    assert [entry["message"] for entry in logger.handlers[0].store] == ["good"]
@@ -0,0 +1,69 @@
+"""Test message merging."""
+import copy
+
+from app.merge import merge_messages
+
+QGRAPH = {"nodes": {"n0": {}, "n1": {}}, "edges": {"e0": {"subject": "n0", "object": "n1"}}}
+
+
+def message(infores, chemical, attributes=()):
+    """Build a one-result message from a provider."""
+    return {
+        "query_graph": QGRAPH,
+        "knowledge_graph": {
+            "nodes": {
+                chemical: {"categories": ["biolink:SmallMolecule"], "attributes": list(attributes)},
+                "MONDO:1": {"categories": ["biolink:Disease"], "attributes": []},
+            },
+            "edges": {
+                "e0": {
+                    "subject": chemical,
+                    "object": "MONDO:1",
+                    "predicate": "biolink:treats",
+                    "sources": [{"resource_id": "infores:primary", "resource_role": "primary_knowledge_source"}],
+                    "attributes": [],
+                },
+            },
+        },
+        "results": [{
+            "node_bindings": {"n0": [{"id": chemical}], "n1": [{"id": "MONDO:1"}]},
+            "analyses": [{"resource_id": infores, "edge_bindings": {"e0": [{"id": "e0"}]}}],
+        }],
+        "auxiliary_graphs": {"a0": {"edges": ["e0"], "attributes": []}},
+    }
+
+
+def test_merge_messages():
+    """Test merging responses from several providers."""
+    messages = [
+        message("infores:kp1", "CHEBI:1", [{"attribute_type_id": "x", "value": 1}]),
+        message("infores:kp2", "CHEBI:1", [{"attribute_type_id": "x", "value": 2}]),
+        message("infores:kp2", "CHEBI:2"),
+    ]
+    original = copy.deepcopy(messages)
+    merged = merge_messages(QGRAPH, messages)
+
+    # inputs are left untouched
+    assert messages == original
+    kgraph = merged["knowledge_graph"]
+    assert set(kgraph["nodes"]) == {"CHEBI:1", "CHEBI:2", "MONDO:1"}
+    assert len(kgraph["nodes"]["CHEBI:1"]["attributes"]) == 2
+    # the same assertion from two providers is one edge
+    assert len(kgraph["edges"]) == 2
+    # results are merged on node bindings, analyses are kept per provider
+    assert len(merged["results"]) == 2
+    assert len(merged["results"][0]["analyses"]) == 2
+    # edge ids are rewritten everywhere
+    edge_id = merged["results"][0]["analyses"][0]["edge_bindings"]["e0"][0]["id"]
+    assert edge_id in kgraph["edges"]
+    assert merged["auxiliary_graphs"]["a0"]["edges"][0] in kgraph["edges"]
+
+
+def test_merge_nothing():
+    """Test merging without responses."""
+    assert merge_messages(QGRAPH, []) == {
+        "query_graph": QGRAPH,
+        "knowledge_graph": None,
+        "results": None,
+        "auxiliary_graphs": None,
+    }
@@ -0,0 +1,35 @@
+"""Test Prometheus metrics."""
+from app.cache import LRUCache
+from app.metrics import CACHE_HITS, CACHE_MISSES, CACHES, Counter, Histogram, Registry
+
+
+def test_render():
+    """Test rendering metrics in the Prometheus text format."""
+    registry = Registry()
+    requests = registry.register(Counter("requests_total", "Requests.", ("service",)))
+    latency = registry.register(Histogram("latency_seconds", "Latency.", buckets=(0.1, 1)))
+    requests.inc(service='say "hi"')
+    requests.inc(2, service='say "hi"')
+    for value in (0.05, 0.1, 0.5, 2):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{service="say \\"hi\\""} 3' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "latency_seconds_sum 2.65" in lines
+    assert "latency_seconds_count 4" in lines
+
+
+def test_cache_metrics(monkeypatch):
+    """Test that named caches report their hits and misses."""
+    # Forget the cache after the test
+    monkeypatch.setitem(CACHES, "test", None)
+    cache = LRUCache(name="test")
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert 'wfr_cache_hits_total{cache="test"} 1' in CACHE_HITS.render().splitlines()
+    assert 'wfr_cache_misses_total{cache="test"} 1' in CACHE_MISSES.render().splitlines()
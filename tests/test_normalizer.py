@@ -0,0 +1,73 @@
+"""Test node normalization."""
+import httpx
+import pytest
+
+from app.normalizer import NodeNormalizer, apply_normalization
+
+NORMALIZED = {
+    "DRUGBANK:DB00331": {
+        "id": {"identifier": "CHEBI:6801", "label": "metformin"},
+        "equivalent_identifiers": [
+            {"identifier": "CHEBI:6801"},
+            {"identifier": "DRUGBANK:DB00331"},
+        ],
+        "type": ["biolink:SmallMolecule"],
+    },
+    "MONDO:0005148": None,
+}
+
+MESSAGE = {
+    "query_graph": {
+        "nodes": {"n0": {"ids": ["DRUGBANK:DB00331"]}, "n1": {}},
+        "edges": {},
+    },
+    "knowledge_graph": {
+        "nodes": {
+            "DRUGBANK:DB00331": {"categories": ["biolink:Drug"], "attributes": []},
+            "MONDO:0005148": {"categories": ["biolink:Disease"], "attributes": []},
+        },
+        "edges": {
+            "e0": {"subject": "DRUGBANK:DB00331", "object": "MONDO:0005148"},
+        },
+    },
+    "results": [{
+        "node_bindings": {
+            "n0": [{"id": "DRUGBANK:DB00331", "attributes": []}],
+            "n1": [{"id": "MONDO:0005148", "attributes": []}],
+        },
+        "analyses": [],
+    }],
+}
+
+
+def test_apply_normalization():
+    """Test rewriting a message in terms of preferred identifiers."""
+    message = apply_normalization(MESSAGE, NORMALIZED)
+    nodes = message["knowledge_graph"]["nodes"]
+    assert set(nodes) == {"CHEBI:6801", "MONDO:0005148"}
+    assert nodes["CHEBI:6801"]["name"] == "metformin"
+    assert nodes["CHEBI:6801"]["attributes"][0]["value"] == ["CHEBI:6801", "DRUGBANK:DB00331"]
+    assert message["knowledge_graph"]["edges"]["e0"]["subject"] == "CHEBI:6801"
+    binding = message["results"][0]["node_bindings"]["n0"][0]
+    assert binding == {"id": "CHEBI:6801", "query_id": "DRUGBANK:DB00331", "attributes": []}
+    # The input is left untouched
+    assert "DRUGBANK:DB00331" in MESSAGE["knowledge_graph"]["nodes"]
+
+
+@pytest.mark.asyncio
+async def test_normalizer_cache():
+    """Test that known CURIEs are not sent to the node normalizer again."""
+    requested = []
+
+    def handler(request):
+        curies = httpx.Response(200, content=request.content).json()["curies"]
+        requested.append(curies)
+        return httpx.Response(200, json={curie: NORMALIZED[curie] for curie in curies})
+
+    normalizer = NodeNormalizer("http://normalizer")
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        await normalizer.normalize_messages([MESSAGE, MESSAGE], client=client)
+        await normalizer.normalize_messages([MESSAGE], client=client)
+    assert requested == [["DRUGBANK:DB00331", "MONDO:0005148"]]
+    assert normalizer.cache.hits == 2
+    assert normalizer.cache.misses == 2
@@ -0,0 +1,89 @@
+"""Test registry snapshots."""
+import fcntl
+import logging
+import os
+
+import pytest
+
+from app import registry
+from app.registry import acquire_refresh_lock, load_snapshot, refresh_registry, save_snapshot, snapshot_version
+from app.smartapi import SmartAPI
+from app.standard_operations import StandardOperations
+
+CONFIG = {"smartapi": "http://smartapi", "operations": "http://operations"}
+HIT = {
+    "info": {
+        "title": "KP",
+        "x-translator": {"infores": "infores:kp"},
+        "x-trapi": {"version": "1.5.0", "operations": ["lookup"]},
+    },
+    "paths": {"/query": {}},
+    "servers": [{"url": "http://kp", "x-maturity": "development"}],
+}
+SCHEMA = {"$defs": {"OperationLookup": {"properties": {"id": {"enum": ["lookup"]}, "unique": {"const": True}}}}}
+
+
+def test_snapshot_roundtrip(tmp_path):
+    """Test that snapshots are only loaded with the configuration they were taken with."""
+    path = str(tmp_path / "registry.json")
+    assert load_snapshot(path, CONFIG) is None
+    save_snapshot(path, {"config": CONFIG, "services": {}})
+    assert load_snapshot(path, CONFIG) == {"config": CONFIG, "services": {}}
+    assert load_snapshot(path, {**CONFIG, "maturity": "production"}) is None
+    # Snapshots that cannot be saved are only logged
+    save_snapshot(str(tmp_path / "missing" / "registry.json"), {"config": CONFIG, "services": {}})
+    assert not (tmp_path / "missing").exists()
+
+
+def test_shared_snapshot(tmp_path, monkeypatch):
+    """Test that replaced snapshots are noticed, and only one process refreshes them."""
+    path = str(tmp_path / "registry.json")
+    assert snapshot_version(path) is None
+    save_snapshot(path, {"config": CONFIG, "services": {}})
+    version = snapshot_version(path)
+    os.utime(path, ns=(version + 10 ** 9, version + 10 ** 9))
+    assert snapshot_version(path) != version
+
+    monkeypatch.setattr(registry, "REFRESH_LOCK", None)
+    with open(path + ".lock", "a") as other_worker:
+        fcntl.flock(other_worker, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        assert not acquire_refresh_lock(path)
+        fcntl.flock(other_worker, fcntl.LOCK_UN)
+    assert acquire_refresh_lock(path)
+    assert acquire_refresh_lock(path)
+    registry.REFRESH_LOCK.close()
+
+
+@pytest.mark.asyncio
+async def test_refresh_unchanged(monkeypatch):
+    """Test that unchanged registry documents are reused from the previous snapshot."""
+    fetched = []
+
+    def fetch_json(url, etag=None):
+        fetched.append(etag)
+        if etag == "v1":
+            return None, etag
+        return ({"hits": [HIT]} if "smartapi" in url else SCHEMA), "v1"
+
+    async def discover_services(endpoints, logger):
+        services = {}
+        for endpoint in endpoints:
+            for operation in endpoint.pop("operations"):
+                services.setdefault(operation, []).append(endpoint)
+        return services
+
+    monkeypatch.setattr(registry, "fetch_json", fetch_json)
+    monkeypatch.setattr(registry, "discover_services", discover_services)
+    smartapi = SmartAPI("development", "1.5.0", logging.getLogger())
+    smartapi.base_url = "http://smartapi"
+    operations = StandardOperations()
+    operations.base_url = "http://operations"
+    logger = logging.getLogger(__name__)
+
+    first = await refresh_registry(smartapi, operations, CONFIG, None, logger)
+    second = await refresh_registry(smartapi, operations, CONFIG, first, logger)
+    assert fetched == [None, None, "v1", "v1"]
+    assert list(second["services"]) == ["lookup"]
+    assert second["operations"]["lookup"]["unique"]
+    assert second["endpoints"] == first["endpoints"]
+    assert "operations" in second["endpoints"][0]
@@ -0,0 +1,49 @@
+"""Test upstream response cache."""
+import pytest
+import reasoner_pydantic
+
+from app.models import Query
+from app.response_cache import ResponseCache, cache_key
+
+MESSAGE = {"query_graph": {"nodes": {}, "edges": {}}}
+
+
+def test_cache_key():
+    """Test that keys do not depend on key order."""
+    assert cache_key({"a": 1, "b": 2}, {"id": "lookup"}, "http://kp") == \
+        cache_key({"b": 2, "a": 1}, {"id": "lookup"}, "http://kp")
+    assert cache_key(MESSAGE, {"id": "lookup"}, "http://kp1") != \
+        cache_key(MESSAGE, {"id": "lookup"}, "http://kp2")
+
+
+@pytest.mark.asyncio
+async def test_response_cache(tmp_path):
+    """Test the memory and disk tiers and per-operation TTLs."""
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(ttls={"annotate_nodes": 0}, path=path)
+    await cache.set("lookup-key", {"message": MESSAGE}, "lookup")
+    await cache.set("annotate-key", {"message": MESSAGE}, "annotate_nodes")
+    assert await cache.get("lookup-key") == {"message": MESSAGE}
+    assert await cache.get("annotate-key") is None
+
+    # A new process only has the disk tier
+    cache = ResponseCache(path=path)
+    assert await cache.get("lookup-key") == {"message": MESSAGE}
+
+
+def test_bypass_cache_runner_parameter():
+    """Test that runner_parameters accept bypass_cache."""
+    query = Query.parse_obj({
+        "message": {},
+        "workflow": [{"id": "lookup", "runner_parameters": {"timeout": 10, "bypass_cache": True}}],
+    })
+    assert query.dict(exclude_unset=True)["workflow"][0]["runner_parameters"] == {
+        "timeout": 10,
+        "bypass_cache": True,
+    }
+    # reasoner-pydantic's own models are left as they are
+    with pytest.raises(ValueError):
+        reasoner_pydantic.Query.parse_obj({
+            "message": {},
+            "workflow": [{"id": "lookup", "runner_parameters": {"bypass_cache": True}}],
+        })
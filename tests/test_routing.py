@@ -0,0 +1,41 @@
+"""Test service routing."""
+from app.routing import RoutingTable
+
+SERVICES = {
+    "lookup": [
+        {"title": "a", "infores": "infores:a"},
+        {"title": "b", "infores": "infores:b"},
+        {"title": "b2", "infores": "infores:b"},
+        {"title": "c", "infores": "infores:c"},
+    ],
+}
+
+
+def titles(services):
+    return [service["title"] for service in services]
+
+
+def test_select():
+    """Test allowlist and denylist filtering."""
+    routing = RoutingTable(SERVICES)
+    assert titles(routing.select("lookup")) == ["a", "b", "b2", "c"]
+    assert titles(routing.select("lookup", allowlist=["infores:c", "infores:b"])) == ["b", "b2", "c"]
+    # Consecutive denied services are all removed
+    assert titles(routing.select("lookup", denylist=["infores:a", "infores:b"])) == ["c"]
+    assert titles(routing.select("lookup", allowlist=["infores:a"], denylist=["infores:a"])) == ["a"]
+    assert routing.select("annotate_nodes") == ()
+
+
+def test_plan_cache():
+    """Test that workflows with the same service selection share a plan."""
+    routing = RoutingTable(SERVICES)
+    workflow = [
+        {"id": "lookup", "runner_parameters": {"denylist": ["infores:a"], "timeout": 10}},
+        {"id": "lookup"},
+    ]
+    plan = routing.plan(workflow)
+    assert [titles(services) for services in plan] == [["b", "b2", "c"], ["a", "b", "b2", "c"]]
+    workflow[0]["runner_parameters"]["timeout"] = 20
+    assert routing.plan(workflow) is plan
+    workflow[0]["runner_parameters"]["denylist"] = ["infores:b"]
+    assert titles(routing.plan(workflow)[0]) == ["a", "c"]
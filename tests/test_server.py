@@ -1,12 +1,20 @@
 """Test server."""
+import asyncio
 import json
 from pathlib import Path
+import time
 
 from fastapi import testclient
 from fastapi.testclient import TestClient
+import httpx
+import pytest
 
+from app import server, util
+from app.admission import AdmissionQueue
+from app.health import HealthTracker
 from app.server import APP
 from app.util import drop_nulls
+from app.wfr_logging import gen_logger
 
 testclient = TestClient(APP)
 
@@ -56,3 +64,106 @@ def test_endpoint():
         "/openapi.json",
     )
     response.raise_for_status()
+
+
+def test_query_stream(monkeypatch):
+    """Test streaming workflow progress as NDJSON."""
+    async def workflow_events(request_dict, logger):
+        yield {"event": "operation", "operation": {"id": "lookup"}, "services": [], "message": {}}
+        yield {"event": "response", "response": {"message": request_dict["message"], "logs": []}}
+
+    monkeypatch.setattr(server, "workflow_events", workflow_events)
+    response = testclient.post(
+        "/query",
+        json=REQUEST,
+        headers={"accept": "application/x-ndjson"},
+    )
+    response.raise_for_status()
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["event"] for event in events] == ["operation", "response"]
+    assert "message" not in events[0]
+    assert events[1]["response"]["message"]["query_graph"] == REQUEST["message"]["query_graph"]
+
+
+@pytest.mark.asyncio
+async def test_wait_for_operation():
+    """Test that operations are cancelled when the deadline passes or the client disconnects."""
+    async def operation(duration):
+        await asyncio.sleep(duration)
+        return duration
+
+    task = asyncio.create_task(operation(10))
+    assert await server.wait_for_operation(task, time.monotonic() + 0.05, None) == "the workflow deadline passed"
+    assert task.cancelled()
+
+    disconnected = asyncio.Event()
+    asyncio.get_running_loop().call_later(0.05, disconnected.set)
+    task = asyncio.create_task(operation(10))
+    assert await server.wait_for_operation(task, time.monotonic() + 10, disconnected) == "the client disconnected"
+    assert task.cancelled()
+
+    task = asyncio.create_task(operation(0))
+    assert await server.wait_for_operation(task, time.monotonic() + 10, asyncio.Event()) is None
+    assert task.result() == 0
+
+
+def test_query_rejected(monkeypatch):
+    """Test that queries are rejected with a 503 when the admission queue is full."""
+    admission = AdmissionQueue(limit=1, queue_size=0)
+    asyncio.run(admission.acquire())
+    monkeypatch.setattr(server, "ADMISSION", admission)
+    response = testclient.post("/query", json=REQUEST)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(server.QUERY_RETRY_AFTER)
+
+
+def test_failed_stream_releases_admission(monkeypatch):
+    """Test that a stream that fails gives back its admission slot."""
+    monkeypatch.setattr(server, "ADMISSION", AdmissionQueue(limit=1, queue_size=0))
+
+    async def failing_events(request_dict, logger, disconnected=None):
+        raise RuntimeError("Workflow failed")
+        yield
+
+    monkeypatch.setattr(server, "workflow_events", failing_events)
+    for _ in range(2):
+        # A leaked slot would get the second query rejected with a 503
+        with pytest.raises(RuntimeError):
+            testclient.post("/query", json={**REQUEST, "stream": True})
+
+
+@pytest.mark.parametrize("timeout", ["abc", None, 0, -1, True])
+def test_invalid_timeout(timeout):
+    """Test that queries with an invalid timeout are rejected."""
+    response = testclient.post("/query", json={**REQUEST, "timeout": timeout})
+    assert response.status_code == 400
+    response = testclient.post("/asyncquery", json={**REQUEST, "timeout": timeout, "callback": "http://localhost/callback"})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_slot_wait_health(monkeypatch):
+    """Test that waiting for a slot to a service does not count against its health."""
+    url = "http://kp/query"
+    service = {"title": "kp", "url": url, "infores": "infores:kp"}
+    slot = asyncio.Semaphore(1)
+    await slot.acquire()
+    monkeypatch.setattr(server, "HEALTH", HealthTracker())
+    monkeypatch.setattr(util, "SERVICE_SLOTS", {url: slot})
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json=RESPONSE))
+    async with httpx.AsyncClient(transport=transport) as client:
+        def query(timeout):
+            return server.scatter_gather(client, [service], REQUEST["message"], {"id": "lookup"}, timeout, gen_logger())
+
+        # Timed out while queued, the service was never asked
+        assert await query(0.05) == []
+        assert server.HEALTH.score(url)["requests"] == 0
+
+        async def free_slot():
+            await asyncio.sleep(0.2)
+            slot.release()
+
+        asyncio.create_task(free_slot())
+        assert len(await query(5)) == 1
+    assert server.HEALTH.score(url)["latency"] < 0.1
@@ -0,0 +1,56 @@
+"""Test upstream response validation."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app.validation import TRAPIStructureError, check_structure, parse_message, should_validate
+
+
+def test_check_structure():
+    """Test the structural check of TRAPI responses."""
+    check_structure({"message": {
+        "knowledge_graph": {
+            "nodes": {"A:1": {}},
+            "edges": {"e0": {"subject": "A:1", "object": "A:1", "predicate": "biolink:related_to"}},
+        },
+        "results": [{"node_bindings": {"n0": [{"id": "A:1"}]}, "analyses": []}],
+        "auxiliary_graphs": None,
+    }})
+    with pytest.raises(TRAPIStructureError):
+        check_structure({"message": {"results": [{"node_bindings": {"n0": {"id": "A:1"}}}]}})
+    with pytest.raises(TRAPIStructureError):
+        check_structure({"message": None})
+
+
+def test_should_validate():
+    """Test validation mode selection."""
+    assert should_validate("full")
+    assert not should_validate("structural")
+    assert should_validate("sampled", sample_rate=1.0)
+    assert not should_validate("sampled", sample_rate=0.0)
+    with pytest.raises(ValueError):
+        should_validate("none")
+
+
+def test_parse_message():
+    """Test parsing a message in a single pass."""
+    message = parse_message({
+        "query_graph": {"nodes": {}, "edges": {}},
+        "knowledge_graph": {"nodes": {}, "edges": {}},
+        "results": [],
+    })
+    assert message.results is not None
+    assert message.auxiliary_graphs is None
+
+
+def test_invalid_mode():
+    """Test that an unknown UPSTREAM_VALIDATION fails at startup."""
+    result = subprocess.run(
+        [sys.executable, "-c", "import app.validation"],
+        env={**os.environ, "UPSTREAM_VALIDATION": "strict"},
+        capture_output=True,
+    )
+    assert result.returncode != 0
+    assert b"Unknown UPSTREAM_VALIDATION 'strict'" in result.stderr